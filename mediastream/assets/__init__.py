@@ -5,7 +5,24 @@ from mediastream.utilities.mediainspector import mt
 import os
 import time
 
-basepath = getattr(settings, 'ASSETS_UPLOAD_TO', '/assets')
+def build_upload_path(filename, artist=None, album=None, is_compilation=False):
+    """Returns where to store a file for a track by artist on album.
+
+    Works from plain names, so it can be used before any rows exist.
+    """
+    basepath = getattr(settings, 'ASSETS_UPLOAD_TO', '/assets')
+
+    # Make filename slightly more unique
+    inst_base, inst_ext = os.path.splitext(filename)
+    inst_base += '_%x' % (time.time()*100)
+    inst_fn = inst_base + inst_ext
+
+    if album is not None and is_compilation:
+        return os.path.join(basepath, 'V', 'Various Artists', album, inst_fn)
+    elif artist is not None and album is not None:
+        return os.path.join(basepath, artist.upper()[0], artist, album, inst_fn)
+    else:
+        return os.path.join(basepath, inst_fn)
 
 def _get_upload_path(instance, filename):
     "Determine the location for uploaded files."
@@ -13,21 +30,14 @@ def _get_upload_path(instance, filename):
         instance.mimetype = mt.guess_type(filename)[0]
         instance.save()
 
-    # Make filename slightly more unique
-    inst_base, inst_ext = os.path.splitext(instance.filename)
-    inst_base += '_%x' % (time.time()*100)
-    inst_fn = inst_base + inst_ext
-
     if hasattr(instance.asset, 'track'):
-        if instance.asset.track.album.is_compilation:
-            return os.path.join(basepath,
-                    'V',
-                    'Various Artists',
-                    instance.asset.track.album.name, inst_fn)
-        else:
-            return os.path.join(basepath,
-                    instance.asset.track.artist.name.upper()[0],
-                    instance.asset.track.artist.name,
-                    instance.asset.track.album.name, inst_fn)
+        track = instance.asset.track
+        return build_upload_path(instance.filename, track.artist.name,
+                                 track.album.name, track.album.is_compilation)
     else:
-        return os.path.join(basepath, inst_fn)
+        return build_upload_path(instance.filename)
+
+def _get_artwork_path(instance, filename):
+    "Artwork is stored by content hash, so identical images share a file."
+    basepath = getattr(settings, 'ASSETS_UPLOAD_TO', '/assets')
+    return os.path.join(basepath, 'artwork', instance.sha1[:2], filename)
@@ -6,6 +6,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.humanize.templatetags.humanize import naturalday
 from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.db.models import Avg, Max, Min, Count
 from django.http import HttpResponseRedirect
 from django.template.defaultfilters import slugify
@@ -15,7 +16,6 @@ from mediastream.tags.models import Tag, TaggedItem
 from mediastream.utilities.recursion import html_tree
 
 from collections import defaultdict
-import json
 import re
 import time
 
@@ -33,9 +33,11 @@ class AlphabeticNameListFilter(admin.SimpleListFilter):
     LETTER_RG = r"^[A-Z]"
 
     def lookups(self, request, model_admin):
-        qs = model_admin.get_queryset(request)
+        # Only the names are needed, so skip the admin's annotations
+        qs = model_admin.model._base_manager.all()
         tn = qs.model._meta.db_table
-        qs = qs.extra(select={'_firstletter': 'upper(left(`%s`.`%s`, 1))' % (tn, self.fieldname)})
+        qn = connection.ops.quote_name
+        qs = qs.extra(select={'_firstletter': 'upper(substr(%s.%s, 1, 1))' % (qn(tn), qn(self.fieldname))})
         cachekey = __name__ + ".AlphabeticNameListFilter." + tn + "." + self.fieldname
         ch = cache.get(cachekey)
         if ch is None:
@@ -98,6 +100,12 @@ def link_to_discogs(modeladmin, request, queryset):
     modeladmin.message_user(request, ', and '.join(out).capitalize())
 link_to_discogs.short_description = 'Create Discogs records'
 
+def queue_discogs_lookup(modeladmin, request, queryset):
+    rows_queued = DiscogsQueueItem.objects.enqueue(queryset.filter(discogs=None))
+    modeladmin.message_user(request, "%i row%s queued for Discogs lookup." %
+        (rows_queued, '' if rows_queued == 1 else 's'))
+queue_discogs_lookup.short_description = 'Queue Discogs lookups'
+
 def merge_assets(modeladmin, request, queryset):
     selected = request.POST.getlist(admin.ACTION_CHECKBOX_NAME)
     ct = ContentType.objects.get_for_model(queryset.model)
@@ -107,9 +115,11 @@ def set_shared_with_all_off(modeladmin, request, queryset):
     rows_updated = 0
     if queryset.model is Track:
         rows_updated = queryset.update(shared_with_all=False)
+        ShuffleCandidate.objects.sync_tracks(queryset)
     elif queryset.model is Album:
         for album in queryset:
             rows_updated += album.track_set.update(shared_with_all=False)
+            ShuffleCandidate.objects.sync_tracks(album.track_set.all())
     modeladmin.message_user(request, "%i asset%s successfully unshared with all." %
         (rows_updated, '' if rows_updated == 1 else 's'))
 set_shared_with_all_off.short_description = "Unshare assets with all users"
@@ -118,9 +128,11 @@ def set_shared_with_all_on(modeladmin, request, queryset):
     rows_updated = 0
     if queryset.model is Track:
         rows_updated = queryset.update(shared_with_all=True)
+        ShuffleCandidate.objects.sync_tracks(queryset)
     elif queryset.model is Album:
         for album in queryset:
             rows_updated += album.track_set.update(shared_with_all=True)
+            ShuffleCandidate.objects.sync_tracks(album.track_set.all())
     modeladmin.message_user(request, "%i asset%s successfully shared with all." %
         (rows_updated, '' if rows_updated == 1 else 's'))
 set_shared_with_all_on.short_description = "Share assets with all users"
@@ -161,9 +173,11 @@ def take_ownership(modeladmin, request, queryset):
     rows_updated = 0
     if queryset.model is Track:
         rows_updated = queryset.update(owner=request.user)
+        ShuffleCandidate.objects.sync_tracks(queryset)
     elif queryset.model is Album:
         for album in queryset:
             rows_updated += album.track_set.update(owner=request.user)
+            ShuffleCandidate.objects.sync_tracks(album.track_set.all())
     modeladmin.message_user(request, "%i asset%s successfully taken by %s." %
         (rows_updated, '' if rows_updated == 1 else 's', request.user.username))
 take_ownership.short_description = "Take ownership of assets"
@@ -172,7 +186,7 @@ class TaggedItemInline(GenericTabularInline):
     model = TaggedItem
 
 class AlbumAdmin(admin.ModelAdmin):
-    actions         = [link_to_discogs, merge_assets, set_shared_with_all_on,
+    actions         = [link_to_discogs, queue_discogs_lookup, merge_assets, set_shared_with_all_on,
                        set_skip_random_off, set_skip_random_on,
                        set_shared_with_all_off, take_ownership,]
     #inlines         = [TaggedItemInline,]
@@ -266,7 +280,7 @@ class AlbumAdmin(admin.ModelAdmin):
 admin.site.register(Album, AlbumAdmin)
 
 class ArtistAdmin(admin.ModelAdmin):
-    actions         = [link_to_discogs]
+    actions         = [link_to_discogs, queue_discogs_lookup]
 
     #inlines         = [TaggedItemInline,]
     list_display    = ['__unicode__', 'is_prince',
@@ -525,14 +539,14 @@ class RatingAdmin(admin.ModelAdmin):
 admin.site.register(Rating, RatingAdmin)
 
 class DiscogsAdmin(admin.ModelAdmin):
-    list_display = ['__unicode__', 'get_asset', 'data_cache_dttm']
+    list_display = ['__unicode__', 'get_asset', 'data_cache_dttm', 'data_cache_expires']
     date_hierarchy  = 'data_cache_dttm'
 
     search_fields = ['object_id', 'artist__name', 'album__name']
 
-    readonly_fields = ['get_asset_link', 'get_pretty_data_cache', 'data_cache_dttm',]
+    readonly_fields = ['get_asset_link', 'get_pretty_data_cache', 'data_cache_dttm', 'data_cache_expires',]
 
-    fields = ['object_type', 'object_id', 'get_asset_link', 'data_cache_dttm', 'get_pretty_data_cache']
+    fields = ['object_type', 'object_id', 'get_asset_link', 'data_cache_dttm', 'data_cache_expires', 'get_pretty_data_cache']
 
     def get_asset_link(self, obj):
         asset = obj.get_asset()
@@ -546,10 +560,25 @@ class DiscogsAdmin(admin.ModelAdmin):
     get_asset_link.allow_tags=True
 
     def get_pretty_data_cache(self, obj):
-        data = json.loads(obj.data_cache)
+        data = obj.parsed_data_cache
         return u'<div class="aligned">{0}</div>'.format(html_tree(data))
     get_pretty_data_cache.short_description='Data cache'
     get_pretty_data_cache.allow_tags=True
 
 
 admin.site.register(Discogs, DiscogsAdmin)
+
+class DiscogsQueueItemAdmin(admin.ModelAdmin):
+    list_display = ['__unicode__', 'state', 'attempts', 'next_attempt', 'last_error']
+    list_filter = ['state', 'object_type']
+    readonly_fields = ['attempts', 'last_error', 'created', 'modified']
+
+admin.site.register(DiscogsQueueItem, DiscogsQueueItemAdmin)
+
+class RenditionAdmin(admin.ModelAdmin):
+    list_display = ['__unicode__', 'profile', 'state', 'size', 'modified', 'last_error']
+    list_filter = ['state', 'profile']
+    raw_id_fields = ['source']
+    readonly_fields = ['assetfile', 'size', 'last_error', 'created', 'modified']
+
+admin.site.register(Rendition, RenditionAdmin)
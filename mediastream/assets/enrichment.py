@@ -0,0 +1,113 @@
+"""
+Background Discogs lookups.
+
+Request handlers only queue Artists and Albums through
+DiscogsQueueItem.objects.enqueue(), and Discogs.data queues stale records
+for a refresh the same way; the discogs_worker management command runs a
+DiscogsEnricher to resolve them at a polite pace.
+"""
+from mediastream.assets.models import Discogs, DiscogsQueueItem
+
+from datetime import datetime, timedelta
+import discogs_client as discogs
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class DiscogsEnricher(object):
+    """
+    Resolves queued Artists and Albums against Discogs, and refreshes
+    queued Discogs records.
+
+    Requests are spaced at least delay seconds apart.  Errors talking to
+    Discogs are retried with exponential backoff, up to max_attempts;
+    objects Discogs does not know about are marked as failed right away.
+    """
+    def __init__(self, client=None, delay=1.0, max_attempts=5,
+                 retry_delay=60, sleep=time.sleep, clock=time.time):
+        self.client = client or discogs
+        self.delay = delay
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._sleep = sleep
+        self._clock = clock
+        self._last_call = None
+
+    def _throttle(self):
+        if self._last_call is not None:
+            wait = self.delay - (self._clock() - self._last_call)
+            if wait > 0:
+                self._sleep(wait)
+        self._last_call = self._clock()
+
+    def process(self, item):
+        "Looks up a single queue item.  Returns True on success."
+        obj = item.get_object()
+        if obj is None or getattr(obj, 'discogs_id', None) is not None:
+            # Gone, or somebody beat us to it.
+            item.delete()
+            return True
+
+        try:
+            if type(obj) is Discogs:
+                obj.refresh(client=self.client, throttle=self._throttle)
+            else:
+                Discogs.objects.get_for_object(obj, client=self.client, throttle=self._throttle)
+        except Discogs.DoesNotExist, e:
+            item.attempts += 1
+            item.last_error = unicode(e)
+            if type(obj) is Discogs:
+                return self._postpone_refresh(item, obj)
+            item.state = DiscogsQueueItem.STATE_FAILED
+            item.save()
+            return False
+        except (Exception, self.client.DiscogsAPIError), e:
+            # Includes DiscogsUnavailable, for rate limits and outages; the
+            # client's own errors derive from BaseException, not Exception
+            logger.exception(e)
+            item.attempts += 1
+            item.last_error = unicode(e)
+            if item.attempts >= self.max_attempts and type(obj) is Discogs:
+                return self._postpone_refresh(item, obj)
+            elif item.attempts >= self.max_attempts:
+                item.state = DiscogsQueueItem.STATE_FAILED
+            else:
+                item.next_attempt = datetime.now() + timedelta(
+                    seconds=self.retry_delay * 2**(item.attempts-1))
+            item.save()
+            return False
+
+        item.delete()
+        return True
+
+    def _postpone_refresh(self, item, obj):
+        "Keeps serving the old payload and tries again next cycle."
+        Discogs.objects.filter(pk=obj.pk).update(
+            data_cache_expires=datetime.now() + obj._get_cache_ttl())
+        item.delete()
+        return False
+
+    def run_once(self, limit=None):
+        """Processes the items that are currently due.
+
+        Returns a (succeeded, failed) tuple.
+        """
+        qs = DiscogsQueueItem.objects.get_due()
+        if limit:
+            qs = qs[:limit]
+
+        succeeded = failed = 0
+        for item in list(qs):
+            if self.process(item):
+                succeeded += 1
+            else:
+                failed += 1
+        return succeeded, failed
+
+    def run_forever(self, idle=60):
+        "Processes items as they come due, napping when there are none."
+        while True:
+            succeeded, failed = self.run_once()
+            if succeeded + failed == 0:
+                self._sleep(idle)
@@ -0,0 +1,260 @@
+"""
+Bulk imports for the import_assets management command.
+
+Importing is split in two so that the slow parts can run in parallel:
+store_file() inspects one file and uploads it (and any embedded artwork)
+to storage without touching the database, so it can run in a pool of
+worker processes; an ImportWriter in the parent process then turns the
+results into Artists, Albums, Tracks and AssetFiles in batched
+transactions, remembering the Artists and Albums it has already seen.
+"""
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count
+
+from mediastream.assets import build_upload_path
+from mediastream.assets.models import (Album, Artist, Artwork, Asset, AssetDescriptor, AssetFile,
+                                       Track, get_extension)
+from mediastream.utilities.lru import LRUCache
+from mediastream.utilities.mediainspector import mt
+
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Artwork this worker has already stored, by SHA-1; albums repeat their covers
+_prepared_artwork = LRUCache(256)
+
+# Inspector attributes that are carried from the workers to the writer
+INSPECTED_FIELDS = ('name', 'artist', 'album', 'is_compilation', 'year', 'track',
+                    'disc', 'length', 'mimetype', 'bitrate', 'is_vbr', 'lossy',
+                    'samplerate')
+
+def iter_paths(paths):
+    "Yields the files named in paths, walking any directories for audio and zip files."
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.path.abspath(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                mimetype = mt.guess_type(filename)[0] or ''
+                if mimetype.startswith('audio/') or mimetype == 'application/zip':
+                    yield os.path.abspath(os.path.join(dirpath, filename))
+
+def store_file(path, name=None, album=None, artist=None):
+    """Inspects the file at path and uploads what it contains to storage.
+
+    Returns a list with one dict per audio file found, holding the tags,
+    the stored name of the file and unsaved Artwork for its pictures, or
+    None where a file lacks the tags needed to import it.  Does not use
+    the database.
+    """
+    storage = AssetFile._meta.get_field('contents').storage
+    records = []
+    with open(path, 'rb') as stash:
+        for f, i in Track.objects.iter_import_files(stash):
+            if artist:
+                i.artist = artist
+            if album:
+                i.album = album
+            if name:
+                i.name = name
+            if i.album is None:
+                i.album = 'Non-album tracks'
+            if not all(getattr(i, attrib, None) for attrib in ('artist', 'album', 'name')):
+                records.append(None)
+                continue
+
+            record = dict((field, getattr(i, field, None)) for field in INSPECTED_FIELDS)
+            record['artist'] = record['artist'].strip()
+            record['album'] = record['album'].strip()
+            upload_path = lambda filename: build_upload_path(
+                filename, record['artist'], record['album'], record['is_compilation'])
+
+            record['stored'] = storage.save(
+                upload_path(i.name + get_extension(i.mimetype)), File(f))
+            record['artwork'] = []
+            for apic in getattr(i, 'artwork', []):
+                sha1 = hashlib.sha1(apic['data']).hexdigest()
+                artwork = _prepared_artwork.get(sha1)
+                if artwork is None:
+                    artwork = Artwork.objects.prepare(apic['data'], apic['mimetype'])
+                    _prepared_artwork.set(sha1, artwork)
+                record['artwork'].append(artwork)
+            records.append(record)
+    return records
+
+def store_file_task(args):
+    "Runs store_file() in a pool worker.  Returns (path, records, error)."
+    path, overrides = args
+    try:
+        return path, store_file(path, **overrides), None
+    except Exception, e:
+        logger.exception(e)
+        return path, None, u'{0}: {1}'.format(e.__class__.__name__, e)
+
+class ImportWriter(object):
+    """
+    Writes stored files to the database in batches.
+
+    Artists and Albums are looked up once per run and kept in memory, and
+    each batch is written in a single transaction.  When progress is an
+    open file, the path of every source file is appended to it once all
+    of its tracks have been committed.
+    """
+    def __init__(self, batch_size=100, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.artists = {}
+        self.albums = {}
+        self.artwork = {}
+        self.pending = []
+
+    def add(self, path, records):
+        """Queues the records stored from one source file.
+
+        Returns what flush() returns if this filled a batch, or [].
+        """
+        self.pending.append((path, records))
+        if sum(len(records) for path, records in self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        "Writes the queued records.  Returns a list of (path, [Track or None, ...])."
+        pending, self.pending = self.pending, []
+        if not pending:
+            return []
+
+        records = [r for path, records in pending for r in records if r]
+        with transaction.atomic():
+            self._load(Artist, self.artists, set(r['artist'] for r in records))
+            self._load(Album, self.albums, set(r['album'] for r in records))
+            tracks = iter(self._write(records))
+            results = [(path, [r and next(tracks) for r in records])
+                       for path, records in pending]
+
+        if self.progress is not None:
+            for path, records in pending:
+                self.progress.write(path + '\n')
+            self.progress.flush()
+        return results
+
+    def _load(self, model, seen, names):
+        "Fills seen, keyed by lowercased name, with a model instance for every name."
+        missing = set(n for n in names if n.lower() not in seen)
+        if not missing:
+            return
+        for obj in model.bare.filter(name__in=missing):
+            seen.setdefault(obj.name.lower(), obj)
+        for name in missing:
+            if name.lower() not in seen:
+                seen[name.lower()], created = model.bare.get_or_create(
+                    name__iexact=name, defaults={'name': name})
+
+    def _write(self, records):
+        """Writes a batch of records.  Returns their Tracks, in order.
+
+        Tracks already imported are found with one query, and files,
+        descriptors and artwork links are inserted in bulk, so the work
+        done by the AssetFile signal handlers is done here once for the
+        batch.  Artwork is picked again once per album.
+        """
+        albums = {}
+        for record in records:
+            album = self.albums[record['album'].lower()]
+            albums[album.pk] = album
+            if record['is_compilation'] is not None and album.is_compilation != record['is_compilation']:
+                album.is_compilation = record['is_compilation']
+                album.save()
+
+        existing = {}
+        for track in Track.objects.filter(album__in=albums.keys(), artist__in=set(
+                        self.artists[r['artist'].lower()].pk for r in records)):
+            existing.setdefault((track.name.lower(), track.album_id, track.artist_id), track)
+        existing_pks = set(t.pk for t in existing.values())
+
+        tracks = []
+        for record in records:
+            artist = self.artists[record['artist'].lower()]
+            album = self.albums[record['album'].lower()]
+            key = (record['name'].lower(), album.pk, artist.pk)
+            if key not in existing:
+                existing[key] = Track.objects.create(
+                    name=record['name'],
+                    album=album,
+                    artist=artist,
+                    track_number=record['track'],
+                    disc_number=record['disc'],
+                    length=record['length'],
+                    year=record['year'],
+                )
+            track = existing[key]
+            track.album, track.artist = album, artist
+            tracks.append(track)
+        track_pks = set(t.pk for t in tracks)
+
+        # bulk_create neither sets order_with_respect_to's _order nor returns pks
+        order = dict((row['asset'], row['files']) for row in AssetFile.objects.filter(
+                        asset__in=existing_pks & track_pks).order_by().values(
+                        'asset').annotate(files=Count('pk')))
+        assetfiles = []
+        for record, track in zip(records, tracks):
+            assetfiles.append(AssetFile(
+                name=record['name'],
+                asset=track,
+                contents=record['stored'],
+                mimetype=record['mimetype'],
+                length=record['length'],
+                _order=order.get(track.pk, 0),
+            ))
+            order[track.pk] = order.get(track.pk, 0) + 1
+        AssetFile.objects.bulk_create(assetfiles)
+        assetfile_pks = dict((name, pk) for pk, name in AssetFile.objects.filter(
+                            asset__in=track_pks, contents__in=[r['stored'] for r in records]
+                            ).values_list('pk', 'contents'))
+        AssetDescriptor.objects.bulk_create([AssetDescriptor(
+                assetfile_id=assetfile_pks[record['stored']],
+                bitstream=0,
+                mimetype=record['mimetype'],
+                bit_rate=record['bitrate'],
+                is_vbr=record['is_vbr'],
+                lossy=record['lossy'],
+                sample_rate=record['samplerate'],
+            ) for record in records])
+        Asset.objects.refresh_stats(track_pks, plays=False, ratings=False)
+        Track.objects.refresh_streamable(track_pks)
+
+        self._load_artwork(set(a.sha1 for r in records for a in r['artwork']), records)
+        links = set(Track.artwork.through.objects.filter(
+                        track__in=existing_pks & track_pks).values_list('track', 'artwork'))
+        new_links = []
+        for record, track in zip(records, tracks):
+            for artwork in record['artwork']:
+                link = (track.pk, self.artwork[artwork.sha1].pk)
+                if link not in links:
+                    links.add(link)
+                    new_links.append(Track.artwork.through(track_id=link[0], artwork_id=link[1]))
+        Track.artwork.through.objects.bulk_create(new_links)
+
+        for album in albums.values():
+            if not album.refresh_artwork():
+                for track in set(t for t in tracks if t.album_id == album.pk):
+                    track.refresh_primary_artwork()
+        return tracks
+
+    def _load_artwork(self, sha1s, records):
+        "Fills self.artwork, keyed by SHA-1, saving any Artwork not stored yet."
+        missing = sha1s.difference(self.artwork)
+        if not missing:
+            return
+        for artwork in Artwork.objects.filter(sha1__in=missing):
+            self.artwork[artwork.sha1] = artwork
+        for record in records:
+            for artwork in record['artwork']:
+                if artwork.sha1 not in self.artwork:
+                    self.artwork[artwork.sha1] = Artwork.objects.save_prepared(artwork)
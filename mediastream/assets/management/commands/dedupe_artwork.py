@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from mediastream.assets.models import Artwork, AssetFile, Track
+from optparse import make_option
+
+class Command(BaseCommand):
+    help = ('Moves pictures extracted onto their own AssetFiles (APIC-...) into '
+            'shared Artwork, storing each distinct image once.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--keep-files',
+            action='store_true',
+            default=False,
+            help="Leave the old AssetFiles' contents in storage.",
+        ),
+    )
+
+    def handle(self, *args, **options):
+        track_pks = set(Track.objects.values_list('pk', flat=True))
+        seen = set()
+        touched = set()
+        moved = freed = 0
+        for assetfile in AssetFile.objects.filter(mimetype__startswith='image/').order_by('pk').iterator():
+            if assetfile.asset_id not in track_pks:
+                continue
+            assetfile.contents.open('rb')
+            try:
+                data = assetfile.contents.read()
+            finally:
+                assetfile.contents.close()
+
+            artwork = Artwork.objects.store(data, assetfile.mimetype)
+            Track.artwork.through.objects.get_or_create(track_id=assetfile.asset_id,
+                                                        artwork=artwork)
+            if artwork.pk in seen:
+                freed += len(data)
+            seen.add(artwork.pk)
+            touched.add(assetfile.asset_id)
+
+            # Drop the stand-in Track.refresh_primary_artwork made for it
+            Artwork.objects.filter(sha1__isnull=True, image=assetfile.contents.name).delete()
+            if not options['keep_files']:
+                assetfile.contents.delete(save=False)
+            assetfile.delete()
+            moved += 1
+
+        for track in Track.objects.filter(pk__in=touched).select_related('album'):
+            track.refresh_artwork()
+
+        self.stdout.write(u"Moved %i pictures into %i artwork; %.1f MB of copies removed\n" % (
+            moved, len(seen), freed / 1048576.0))
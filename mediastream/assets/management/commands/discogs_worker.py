@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from mediastream.assets.enrichment import DiscogsEnricher
+from mediastream.assets.models import Discogs, DiscogsQueueItem
+from optparse import make_option
+
+class Command(BaseCommand):
+    help = 'Resolves queued Artists and Albums against Discogs.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--once',
+            action='store_true',
+            default=False,
+            help='Process the items that are due, then exit.',
+        ),
+        make_option('--delay',
+            type='float',
+            default=1.0,
+            help='Minimum seconds between Discogs lookups.',
+        ),
+        make_option('--max-attempts',
+            type='int',
+            default=5,
+            help='Give up on an item after this many errors.',
+        ),
+        make_option('--stats',
+            action='store_true',
+            default=False,
+            help='Show Discogs cache counters and refresh schedule, then exit.',
+        ),
+        make_option('--idle',
+            type='int',
+            default=60,
+            help='Seconds to sleep when nothing is due.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = Discogs.objects.get_cache_stats()
+            self.stdout.write(u"Cache hits %i, misses %i, stale %i\n" % (
+                stats['hit'], stats['miss'], stats['stale']))
+            self.stdout.write(u"Overdue %i, unscheduled %i, queued for refresh %i\n" % (
+                stats['overdue'], stats['unscheduled'], stats['refreshing']))
+            for day, count in stats['schedule']:
+                self.stdout.write(u"  %s: %i expiring\n" % (day.isoformat(), count))
+            return
+
+        enricher = DiscogsEnricher(
+            delay=options['delay'],
+            max_attempts=options['max_attempts'],
+        )
+
+        if options['once']:
+            succeeded, failed = enricher.run_once()
+            self.stdout.write(u"Resolved %i item%s, %i failed, %i still waiting\n" % (
+                succeeded, '' if succeeded == 1 else 's', failed,
+                DiscogsQueueItem.objects.filter(state=DiscogsQueueItem.STATE_WAITING).count()))
+        else:
+            enricher.run_forever(idle=options['idle'])
@@ -1,10 +1,18 @@
 from django.core.management.base import BaseCommand, CommandError
-from mediastream.assets.models import Track
+from django.db import connection
+from mediastream.assets.importer import ImportWriter, iter_paths, store_file_task
+from multiprocessing import Pool
 from optparse import make_option
+import itertools
+import os
+import sys
+import time
 
 class Command(BaseCommand):
-    args = '<filename filename ...>'
-    help = 'Imports the provided assets.'
+    args = '<filename or directory ...>'
+    help = ('Imports the provided assets.  Directories are searched for audio '
+            'and zip files.  With --workers, files are inspected and uploaded '
+            'in parallel while a single process writes to the database.')
 
     option_list = BaseCommand.option_list + (
         make_option('--name',
@@ -16,13 +24,94 @@ class Command(BaseCommand):
         make_option('--artist',
             default=None,
         ),
+        make_option('--workers',
+            type='int',
+            default=1,
+            help='Number of processes inspecting and uploading files.',
+        ),
+        make_option('--batch-size',
+            type='int',
+            default=100,
+            help='Number of tracks to write per database transaction.',
+        ),
+        make_option('--progress',
+            default=None,
+            help='File recording what has been imported.  Files listed in it '
+                 'are skipped, so an interrupted import can be run again.',
+        ),
     )
 
     def handle(self, *args, **options):
-        for newfile in args:
-            newtracks = Track.objects.create_from_file(newfile, name=options['name'], album=options['album'], artist=options['artist'])
+        if not args:
+            raise CommandError('Provide at least one file or directory to import.')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        # Work with byte string paths, as os.walk and the progress file do
+        args = [a.encode(sys.getfilesystemencoding()) if isinstance(a, unicode) else a
+                for a in args]
+
+        done = set()
+        progress = None
+        if options['progress']:
+            if os.path.exists(options['progress']):
+                with open(options['progress']) as f:
+                    done = set(line.rstrip('\n') for line in f)
+            progress = open(options['progress'], 'a')
+
+        skipped = [0]
+        def todo():
+            for path in iter_paths(args):
+                if path in done:
+                    skipped[0] += 1
+                else:
+                    yield path
+        overrides = dict((k, options[k]) for k in ('name', 'album', 'artist'))
+        tasks = itertools.izip(todo(), itertools.repeat(overrides))
+
+        writer = ImportWriter(batch_size=options['batch_size'], progress=progress)
+        pool = None
+        if options['workers'] > 1:
+            # Workers don't use the database; don't let them share our connection.
+            connection.close()
+            pool = Pool(options['workers'])
+            results = pool.imap_unordered(store_file_task, tasks)
+        else:
+            results = itertools.imap(store_file_task, tasks)
+
+        started = time.time()
+        files = tracks = failed = 0
+        try:
+            for path, records, error in results:
+                if error:
+                    failed += 1
+                    self.stderr.write(u"Could not import %s: %s" % (path.decode('utf-8', 'replace'), error))
+                    continue
+                files += 1
+                tracks += self._report(writer.add(path, records))
+        finally:
+            tracks += self._report(writer.flush())
+            if pool is not None:
+                pool.terminate()
+            if progress is not None:
+                progress.close()
+
+        elapsed = time.time() - started
+        self.stdout.write(u"Imported %i tracks from %i files in %.1fs (%.1f files/s); "
+                          u"%i already imported, %i failed\n" % (
+                          tracks, files, elapsed, files / max(elapsed, 0.001),
+                          skipped[0], failed))
+
+    def _report(self, results):
+        count = 0
+        for newfile, newtracks in results:
+            newfile = newfile.decode('utf-8', 'replace')
             for newtrack in newtracks:
+                if newtrack is None:
+                    self.stderr.write(u"Skipped a file in %s without artist or title tags" % newfile)
+                    continue
+                count += 1
                 try:
                     self.stdout.write(u"Successfully imported from %s: pk %i, %s / %s / %s\n" % (newfile, newtrack.pk, newtrack.artist.name, newtrack.album.name, newtrack.name))
                 except UnicodeError:
                     self.stdout.write(u"Successfully imported a track pk %i\n" % (newtrack.pk))
+        return count
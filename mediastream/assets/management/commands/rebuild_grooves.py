@@ -0,0 +1,18 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from mediastream.assets.models import GrooveEdge
+
+class Command(BaseCommand):
+    args = '<username username ...>'
+    help = 'Recounts groove edges from Play history for the given users, or everyone.'
+
+    def handle(self, *args, **options):
+        users = None
+        if args:
+            users = User.objects.filter(username__in=args)
+            if users.count() != len(args):
+                raise CommandError('Unknown user in %s' % ', '.join(args))
+
+        count = GrooveEdge.objects.rebuild(users)
+        self.stdout.write(u"Rebuilt %i groove edge%s\n" % (
+            count, '' if count == 1 else 's'))
@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from mediastream.assets.models import ShuffleCandidate
+
+class Command(BaseCommand):
+    args = '<username username ...>'
+    help = 'Rebuilds the shuffle candidate pool for the given users, or everyone.'
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if args:
+            users = users.filter(username__in=args)
+            if users.count() != len(args):
+                raise CommandError('Unknown user in %s' % ', '.join(args))
+
+        for user in users.order_by('pk'):
+            count = ShuffleCandidate.objects.rebuild_for_user(user)
+            self.stdout.write(u"Rebuilt pool for %s: %i track%s\n" % (
+                user.username, count, '' if count == 1 else 's'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from mediastream.assets.models import Asset, ShuffleCandidate
+from optparse import make_option
+
+class Command(BaseCommand):
+    help = 'Recounts the stored play, rating and file statistics of every Asset.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk',
+            type='int',
+            default=500,
+            help='Assets to recount per batch.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        pks = list(Asset._base_manager.order_by('pk').values_list('pk', flat=True))
+        fixed = 0
+        for start in range(0, len(pks), options['chunk']):
+            changed = Asset.objects.refresh_stats(pks[start:start+options['chunk']])
+            for pk in changed:
+                ShuffleCandidate.objects.refresh_track(pk)
+            fixed += len(changed)
+
+        self.stdout.write(u"Checked %i asset%s, corrected %i\n" % (
+            len(pks), '' if len(pks) == 1 else 's', fixed))
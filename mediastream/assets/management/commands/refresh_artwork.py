@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from mediastream.assets.models import Album, Track
+
+class Command(BaseCommand):
+    help = 'Picks the primary artwork of every album, then of every track.'
+
+    def handle(self, *args, **options):
+        albums = changed = 0
+        for album in Album.bare.select_related('discogs').order_by('pk').iterator():
+            albums += 1
+            if album.refresh_primary_artwork():
+                changed += 1
+
+        tracks = 0
+        for track in Track.objects.select_related('album', 'artist__discogs').order_by('pk').iterator():
+            tracks += 1
+            track.refresh_primary_artwork()
+
+        self.stdout.write(u"Checked %i albums (%i changed) and %i tracks\n" % (
+            albums, changed, tracks))
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from mediastream.assets.models import AssetFile
+from mediastream.assets.scanner import save_scans, scan_file_task
+from datetime import datetime
+from multiprocessing import Pool
+from optparse import make_option
+import time
+
+class Command(BaseCommand):
+    help = ('Re-reads the tags of audio files whose contents changed since they '
+            'were last inspected, and updates their files, descriptors and tracks.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--force',
+            action='store_true',
+            default=False,
+            help='Inspect every file again, ignoring cached results.',
+        ),
+        make_option('--workers',
+            type='int',
+            default=1,
+            help='Number of processes inspecting files.',
+        ),
+        make_option('--chunk',
+            type='int',
+            default=500,
+            help='Files to scan and write per batch.',
+        ),
+        make_option('--mimetype',
+            default='audio/',
+            help='Only scan files whose MIME type starts with this.',
+        ),
+        make_option('--missing-length',
+            action='store_true',
+            default=False,
+            help='Only scan files without a length.',
+        ),
+        make_option('--modified-since',
+            default=None,
+            help='Only scan files changed on or after this date (YYYY-MM-DD).',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        qs = AssetFile.objects.filter(mimetype__startswith=options['mimetype'])
+        if options['missing_length']:
+            qs = qs.filter(length__isnull=True)
+        if options['modified_since']:
+            try:
+                since = datetime.strptime(options['modified_since'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--modified-since takes a date like 2014-01-31.')
+            qs = qs.filter(modified__gte=since)
+
+        pool = None
+        if options['workers'] > 1:
+            # Workers don't use the database; don't let them share our connection.
+            connection.close()
+            pool = Pool(options['workers'])
+
+        started = time.time()
+        checked = unchanged = rescanned = failed = size = 0
+        last_pk = 0
+        try:
+            while True:
+                rows = list(qs.filter(pk__gt=last_pk).order_by('pk').values_list(
+                    'pk', 'contents', 'mimetype', 'asset_id',
+                    'inspection__fingerprint', 'inspection__size')[:options['chunk']])
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+
+                tasks = [(pk, name, mimetype, (fingerprint, known_size) if fingerprint else None,
+                          options['force'])
+                         for pk, name, mimetype, asset_id, fingerprint, known_size in rows]
+                if pool is not None:
+                    scans = pool.map(scan_file_task, tasks)
+                else:
+                    scans = map(scan_file_task, tasks)
+
+                for pk, fingerprint, fields, error in scans:
+                    if error:
+                        failed += 1
+                        self.stderr.write(u"Could not scan AssetFile %i: %s" % (pk, error))
+                    elif fields is None:
+                        unchanged += 1
+                    elif fingerprint:
+                        # Unchanged files were only stat()ed, not read
+                        size += fingerprint[1]
+                checked += len(rows)
+                rescanned += save_scans(scans, dict((row[0], row[3]) for row in rows))
+
+                if int(options['verbosity']) > 1:
+                    self.stdout.write(u"%i files, %s\n" % (checked, self._rates(started, checked, size)))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.stdout.write(u"Checked %i files: %i unchanged, %i rescanned, %i unreadable\n" % (
+            checked, unchanged, rescanned, failed))
+        self.stdout.write(u"%.1f MB inspected in %.1fs, %s\n" % (
+            size / 1048576.0, time.time() - started, self._rates(started, checked, size)))
+
+    def _rates(self, started, files, size):
+        elapsed = max(time.time() - started, 0.001)
+        return u"%.1f files/s, %.1f MB/s" % (files / elapsed, size / 1048576.0 / elapsed)
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from mediastream.assets.models import Rendition, Track, TRANSCODE_BUDGET, TRANSCODE_PROFILE, TRANSCODE_PROFILES
+from mediastream.assets.transcoder import save_renditions, transcode_task
+from multiprocessing import Pool
+from optparse import make_option
+
+class Command(BaseCommand):
+    help = ('Transcodes the renditions waiting to be made, then deletes the '
+            'least recently played ones that no longer fit the disk budget.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--all',
+            action='store_true',
+            default=False,
+            help='First queue renditions for every track with nothing to stream.',
+        ),
+        make_option('--profile',
+            default=TRANSCODE_PROFILE,
+            help='Rendition format for --all: %s.' % ', '.join(sorted(TRANSCODE_PROFILES)),
+        ),
+        make_option('--workers',
+            type='int',
+            default=1,
+            help='Number of ffmpeg processes to run at once.',
+        ),
+        make_option('--budget',
+            type='int',
+            default=TRANSCODE_BUDGET / 1048576,
+            help='Megabytes of renditions to keep.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        if options['profile'] not in TRANSCODE_PROFILES:
+            raise CommandError('--profile must be one of %s.' % ', '.join(sorted(TRANSCODE_PROFILES)))
+
+        if options['all']:
+            queued = Rendition.objects.request(
+                Track.objects.filter(streamable_file__isnull=True), options['profile'])
+            self.stdout.write(u"Queued %i renditions\n" % queued)
+
+        tasks = [(pk, name, profile) for pk, name, profile in Rendition.objects.filter(
+                    state=Rendition.STATE_WAITING).order_by('pk').values_list(
+                    'pk', 'source__contents', 'profile')]
+        made = failed = 0
+        if tasks:
+            pool = None
+            if options['workers'] > 1:
+                # Workers don't use the database; don't let them share our connection.
+                connection.close()
+                pool = Pool(options['workers'])
+            try:
+                chunk = options['workers'] * 4
+                for start in range(0, len(tasks), chunk):
+                    if pool is not None:
+                        results = pool.map(transcode_task, tasks[start:start + chunk])
+                    else:
+                        results = map(transcode_task, tasks[start:start + chunk])
+                    for pk, stored, size, fields, error in results:
+                        if error:
+                            self.stderr.write(u"Could not transcode rendition %i: %s" % (pk, error))
+                    done = save_renditions(results)
+                    made += done[0]
+                    failed += done[1]
+            finally:
+                if pool is not None:
+                    pool.terminate()
+
+        evicted, freed = Rendition.objects.evict(options['budget'] * 1048576)
+        self.stdout.write(u"Made %i renditions, %i failed; evicted %i (%.1f MB)\n" % (
+            made, failed, evicted, freed / 1048576.0))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'DiscogsQueueItem'
+        db.create_table(u'assets_discogsqueueitem', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('object_type', self.gf('django.db.models.fields.PositiveSmallIntegerField')()),
+            ('object_id', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('state', self.gf('django.db.models.fields.CharField')(default='waiting', max_length=10)),
+            ('attempts', self.gf('django.db.models.fields.PositiveSmallIntegerField')(default=0)),
+            ('next_attempt', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now, db_index=True)),
+            ('last_error', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('modified', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+        ))
+        db.send_create_signal(u'assets', ['DiscogsQueueItem'])
+
+        # Adding unique constraint on 'DiscogsQueueItem', fields ['object_type', 'object_id']
+        db.create_unique(u'assets_discogsqueueitem', ['object_type', 'object_id'])
+
+
+        # Changing field 'Asset.owner'
+        db.alter_column(u'assets_asset', 'owner_id', self.gf('django.db.models.fields.related.ForeignKey')(null=True, on_delete=models.SET_NULL, to=orm['auth.User']))
+
+        # Changing field 'Album.discogs'
+        db.alter_column(u'assets_album', 'discogs_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Discogs'], null=True, on_delete=models.SET_NULL))
+
+        # Changing field 'Play.queue'
+        db.alter_column(u'assets_play', 'queue_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['queuer.AssetQueue'], null=True, on_delete=models.SET_NULL))
+
+        # Changing field 'Play.user'
+        db.alter_column(u'assets_play', 'user_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['auth.User'], null=True, on_delete=models.SET_NULL))
+
+        # Changing field 'Play.previous_play'
+        db.alter_column(u'assets_play', 'previous_play_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Play'], null=True, on_delete=models.SET_NULL))
+
+        # Changing field 'Artist.discogs'
+        db.alter_column(u'assets_artist', 'discogs_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Discogs'], null=True, on_delete=models.SET_NULL))
+
+        # Changing field 'Rating.play'
+        db.alter_column(u'assets_rating', 'play_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Play'], null=True, on_delete=models.SET_NULL))
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'DiscogsQueueItem', fields ['object_type', 'object_id']
+        db.delete_unique(u'assets_discogsqueueitem', ['object_type', 'object_id'])
+
+        # Deleting model 'DiscogsQueueItem'
+        db.delete_table(u'assets_discogsqueueitem')
+
+
+        # Changing field 'Asset.owner'
+        db.alter_column(u'assets_asset', 'owner_id', self.gf('django.db.models.fields.related.ForeignKey')(null=True, to=orm['auth.User']))
+
+        # Changing field 'Album.discogs'
+        db.alter_column(u'assets_album', 'discogs_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Discogs'], null=True))
+
+        # Changing field 'Play.queue'
+        db.alter_column(u'assets_play', 'queue_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['queuer.AssetQueue'], null=True))
+
+        # Changing field 'Play.user'
+        db.alter_column(u'assets_play', 'user_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['auth.User'], null=True))
+
+        # Changing field 'Play.previous_play'
+        db.alter_column(u'assets_play', 'previous_play_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Play'], null=True))
+
+        # Changing field 'Artist.discogs'
+        db.alter_column(u'assets_artist', 'discogs_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Discogs'], null=True))
+
+        # Changing field 'Rating.play'
+        db.alter_column(u'assets_rating', 'play_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['assets.Play'], null=True))
+
+    models = {
+        u'assets.album': {
+            'Meta': {'ordering': "['name']", 'object_name': 'Album'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'discogs': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Discogs']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'discs': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'extra_artists': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'album_credits'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['assets.Artist']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_compilation': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'assets.artist': {
+            'Meta': {'ordering': "['name']", 'object_name': 'Artist'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'discogs': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Discogs']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_prince': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'assets.asset': {
+            'Meta': {'object_name': 'Asset'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'owned_assets'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': u"orm['auth.User']"}),
+            'shared_with': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'shared_assets'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['auth.User']"}),
+            'shared_with_all': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        u'assets.assetdescriptor': {
+            'Meta': {'ordering': "['bitstream']", 'unique_together': "(('assetfile', 'bitstream'),)", 'object_name': 'AssetDescriptor'},
+            'assetfile': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.AssetFile']"}),
+            'bit_rate': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'bitstream': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_vbr': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'lossy': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'mimetype': ('django.db.models.fields.CharField', [], {'default': "'application/octet-stream'", 'max_length': '255'}),
+            'sample_rate': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'assets.assetfile': {
+            'Meta': {'ordering': "(u'_order',)", 'object_name': 'AssetFile'},
+            '_order': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'asset': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Asset']"}),
+            'contents': ('django.db.models.fields.files.FileField', [], {'max_length': '255'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'length': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'mimetype': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'assets.discogs': {
+            'Meta': {'ordering': "('object_type', 'object_id')", 'unique_together': "(('object_type', 'object_id'),)", 'object_name': 'Discogs'},
+            'data_cache': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'data_cache_dttm': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'object_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'object_type': ('django.db.models.fields.PositiveSmallIntegerField', [], {})
+        },
+        u'assets.discogsqueueitem': {
+            'Meta': {'ordering': "('next_attempt', 'pk')", 'unique_together': "(('object_type', 'object_id'),)", 'object_name': 'DiscogsQueueItem'},
+            'attempts': ('django.db.models.fields.PositiveSmallIntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'object_type': ('django.db.models.fields.PositiveSmallIntegerField', [], {}),
+            'state': ('django.db.models.fields.CharField', [], {'default': "'waiting'", 'max_length': '10'})
+        },
+        u'assets.play': {
+            'Meta': {'object_name': 'Play'},
+            'asset': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Asset']"}),
+            'context': ('django.db.models.fields.SmallIntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'in_groove': ('django.db.models.fields.NullBooleanField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'played': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'previous_play': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Play']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'queue': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['queuer.AssetQueue']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'})
+        },
+        u'assets.rating': {
+            'Meta': {'object_name': 'Rating'},
+            'asset': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Asset']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'play': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Play']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'rating': ('django.db.models.fields.SmallIntegerField', [], {'default': '0'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"})
+        },
+        u'assets.track': {
+            'Meta': {'ordering': "(u'_order',)", 'object_name': 'Track', '_ormbases': [u'assets.Asset']},
+            '_order': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'album': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Album']"}),
+            'artist': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['assets.Artist']"}),
+            u'asset_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': u"orm['assets.Asset']", 'unique': 'True', 'primary_key': 'True'}),
+            'bpm': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'disc_number': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'extra_artists': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'track_credits'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['assets.Artist']"}),
+            'length': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'skip_random': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'track_number': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'year': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'queuer.assetqueue': {
+            'Meta': {'object_name': 'AssetQueue'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'expire_old_items': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'randomize': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"})
+        }
+    }
+
+    complete_apps = ['assets']
\ No newline at end of file
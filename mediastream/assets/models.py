@@ -5,43 +5,175 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.files import File
 from django.core.files.base import ContentFile
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models import Avg, Max, Count, Q
-
-from mediastream.assets import _get_upload_path
+from django.db import IntegrityError, models, transaction
+from django.db.models import Avg, Max, Count, F, Q, Sum
+from django.db.models.query import QuerySet
+from django.db.models.sql import aggregates as sql_aggregates
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.encoding import force_bytes
+
+from mediastream.assets import _get_artwork_path, _get_upload_path
+from mediastream.assets import shuffle
+from mediastream.assets.streaming import get_stream_url
 from mediastream.utilities.mediainspector import mt as mimetypes
-from mediastream.utilities.mediainspector import Inspector, MIMETYPE_CHOICES
-
+from mediastream.utilities.mediainspector import Inspector, InspectableFile, MIMETYPE_CHOICES
+from mediastream.utilities import instrumentation
+from mediastream.utilities.lru import LRUCache
+from mediastream.utilities.rangefile import open_ranged
+from mediastream.utilities.s3media import prefetch_urls
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from StringIO import StringIO
 import discogs_client as discogs
+import hashlib
 import logging
 import json
+import math
 import os
 import random
-from tempfile import NamedTemporaryFile
+import re
+import shutil
+import time
+from tempfile import SpooledTemporaryFile
 from urlparse import urlparse
 import zipfile
 
 # Approximate window for repeating Tracks
 RECENT_DAYS = 30
 
+# How long Discogs data stays fresh, and how much to spread that out
+DISCOGS_CACHE_DAYS = 30
+DISCOGS_CACHE_JITTER = 0.2
+
+# Decoded Discogs payloads, keyed by (pk, data_cache_dttm)
+_parsed_payloads = LRUCache(getattr(settings, 'DISCOGS_PARSED_CACHE_SIZE', 128))
+
+# Shuffle scorers, keyed by user pk, and how long to trust them
+_shuffle_scorers = LRUCache(16)
+SHUFFLE_SCORER_TTL = 600
+SHUFFLE_BATCH = 20
+
+# Inspector attributes that InspectionResult keeps
+INSPECTION_TAGS = ('name', 'artist', 'album', 'band', 'genre', 'year', 'track',
+                   'disc', 'is_compilation')
+
+# Longest side of artwork thumbnails, and their JPEG quality
+ARTWORK_THUMBNAIL_SIZE = getattr(settings, 'ARTWORK_THUMBNAIL_SIZE', 300)
+ARTWORK_THUMBNAIL_QUALITY = 85
+
+# Zip members bigger than this spill from memory to disk while importing
+IMPORT_SPOOL_BYTES = 8*1024*1024
+IMPORT_CHUNK_BYTES = 64*1024
+
 logger = logging.getLogger(__name__)
 
 discogs.user_agent = settings.HTTP_USER_AGENT
 
+EXTENSIONS = {
+    'audio/mpeg': '.mp3',
+    'audio/mp4': '.m4a',
+    'audio/x-flac': '.flac',
+    'audio/ogg': '.ogg',
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+}
+
+# Extensions players can stream, and the jPlayer format each is supplied as.
+#STREAMING_FORMATS = {'.mp3': 'mp3', '.m4a': 'm4a', '.spx': 'oga', '.ogg': 'oga'}
+STREAMING_FORMATS = {'.mp3': 'mp3', '.m4a': 'm4a'}  # :-(
+# The same, by the MIME type AssetDescriptors record
+STREAMING_MIMETYPES = {'audio/mpeg': 'mp3', 'audio/mp4': 'm4a'}
+
+# Renditions transcode_assets can make: extension, MIME type and ffmpeg
+# codec arguments.  Tracks with nothing to stream get TRANSCODE_PROFILE,
+# and renditions are evicted, least recently played first, to keep them
+# within TRANSCODE_BUDGET bytes.
+TRANSCODE_PROFILES = {
+    'mp3':  ('.mp3', 'audio/mpeg', ['-codec:a', 'libmp3lame', '-q:a', '2']),
+    'm4a':  ('.m4a', 'audio/mp4', ['-codec:a', 'aac', '-strict', 'experimental',
+                                   '-b:a', '192k', '-movflags', '+faststart']),
+    'opus': ('.opus', 'audio/ogg', ['-codec:a', 'libopus', '-b:a', '128k']),
+}
+TRANSCODE_PROFILE = getattr(settings, 'ASSETS_TRANSCODE_PROFILE', 'mp3')
+TRANSCODE_BUDGET = getattr(settings, 'ASSETS_TRANSCODE_BUDGET', 10*1024*1024*1024)
+
+def get_extension(mimetype):
+    "Returns the file extension we use for a MIME type."
+    return EXTENSIONS.get(mimetype) or mimetypes.guess_extension(mimetype, False)
+
 def playtime(rating=None):
     minimum = RECENT_DAYS
     if rating:
         minimum *= rating**-1
     return timedelta(days=minimum)
 
+class DiscogsUnavailable(Exception):
+    "Discogs couldn't answer just now, such as when rate limiting; try again later."
+
+# HTTP statuses, found in DiscogsAPIError messages, that are worth retrying
+DISCOGS_STATUS_RE = re.compile(r'\b([1-5]\d\d)\b')
+
+def is_transient_discogs_error(e):
+    "Returns True if a DiscogsAPIError is a 429 or 5xx response."
+    match = DISCOGS_STATUS_RE.search(str(e))
+    return match is not None and (match.group(1) == '429' or match.group(1).startswith('5'))
+
+def bulk_create_new(manager, objs):
+    """Inserts objs with bulk_create, skipping any that collide with rows
+    another process inserted since the caller looked.  Returns the
+    number inserted.
+    """
+    objs = list(objs)
+    try:
+        with transaction.atomic():
+            manager.bulk_create(objs)
+        return len(objs)
+    except IntegrityError:
+        pass
+    # Somebody got some of these in first; add the rest one by one
+    inserted = 0
+    for obj in objs:
+        try:
+            with transaction.atomic():
+                obj.save(force_insert=True)
+            inserted += 1
+        except IntegrityError:
+            pass
+    return inserted
+
+@contextmanager
+def discogs_request(throttle=None):
+    "Times one request to Discogs, calling throttle() first if given."
+    if throttle is not None:
+        throttle()
+    with instrumentation.timed_http():
+        yield
+
 class DiscogsManager(models.Manager):
-    def get_for_object(self, obj):
-        "Attempts to find a Discogs record for an album or artist."
+    def get_for_object(self, obj, client=None, throttle=None):
+        """Attempts to find a Discogs record for an album or artist.
+
+        client defaults to the discogs_client module; anything providing
+        the same Artist, Release, MasterRelease, Search and DiscogsAPIError
+        names may be used instead.  throttle, if given, is called before
+        every request to Discogs.
+        """
+        if client is None:
+            client = discogs
+        source = None
+
         if type(obj) is Artist:
             obj_type    = Discogs.ARTIST
             obj_id      = obj.name
-            obj_class   = discogs.Artist
+            obj_class   = client.Artist
 
             if obj_id.startswith("The "):
                 # Discogs does "The Blah Blah" -> "Blah Blah, The"
@@ -50,28 +182,40 @@ class DiscogsManager(models.Manager):
         elif type(obj) is Album:
             obj_type    = Discogs.RELEASE
             obj_id      = None
-            obj_class   = discogs.Release
+            obj_class   = client.Release
 
             try:
-                results = sorted(discogs.Search(obj.name).results())
-            except discogs.DiscogsAPIError, e:
+                with discogs_request(throttle):
+                    results = sorted(client.Search(obj.name).results())
+            except client.DiscogsAPIError, e:
+                if is_transient_discogs_error(e):
+                    raise DiscogsUnavailable(u"Could not search Discogs for {0}: {1}".format(obj.name, e))
                 results = []
+            my_tracks = list(obj.track_set.values_list('name', flat=True))
             for result in results:
-                if type(result) not in [discogs.Release, discogs.MasterRelease]:
+                if type(result) not in [client.Release, client.MasterRelease]:
                     continue
 
-                # Check track list concurrence
+                # Check track list concurrence; each hit is fetched separately
+                try:
+                    with discogs_request(throttle):
+                        tracklist = result.tracklist
+                except client.DiscogsAPIError, e:
+                    if is_transient_discogs_error(e):
+                        raise DiscogsUnavailable(u"Could not fetch Discogs release {0} for {1}: {2}".format(
+                                                    result._id, obj.name, e))
+                    continue
                 tracks_matched = 0
-                my_tracks = obj.track_set.values_list('name', flat=True)
-                for discogs_track in result.tracklist:
+                for discogs_track in tracklist:
                     if discogs_track['title'] in my_tracks:
                         tracks_matched += 1
                 if tracks_matched > (len(my_tracks)/2):
-                    # We probably have a winner here
+                    # We probably have a winner here, already fetched
+                    source = result
                     obj_id = result._id
-                    if type(result) is discogs.MasterRelease:
+                    if type(result) is client.MasterRelease:
                         obj_type = Discogs.MASTERRELEASE
-                        obj_class = discogs.MasterRelease
+                        obj_class = client.MasterRelease
                     break
 
         # Bail out on errors
@@ -83,28 +227,59 @@ class DiscogsManager(models.Manager):
             existing_obj = self.get(object_type=obj_type, object_id=obj_id)
             obj.discogs = existing_obj
             obj.save()
+            obj.refresh_artwork()
             return existing_obj
         except Discogs.DoesNotExist:
             pass
         
         # Try to pull some data from it
         try:
-            data = obj_class(obj_id).data
-        except discogs.DiscogsAPIError, e:
+            if source is None:
+                with discogs_request(throttle):
+                    data = obj_class(obj_id).data
+            else:
+                data = source.data
+        except client.DiscogsAPIError, e:
+            if is_transient_discogs_error(e):
+                raise DiscogsUnavailable(u"Could not retrieve Discogs object for {0}: {1}".format(obj.name, e))
             raise Discogs.DoesNotExist(u"Could not retrieve Discogs object for {0} using {1}({2}): {3}".format(obj.name, repr(obj_class), repr(obj_id), e))
 
         # Save stuff!
-        new_obj = self.create(object_type=obj_type,
-                           object_id=obj_id,
-                           data_cache=json.dumps(data),
-                           data_cache_dttm=datetime.now())
+        new_obj = Discogs(object_type=obj_type, object_id=obj_id)
+        new_obj.set_data(data)
+        new_obj.save()
 
         # Point our object at it
         obj.discogs = new_obj
         obj.save()
+        obj.refresh_artwork()
 
         return new_obj
 
+    def get_cache_stats(self, days=7):
+        """Returns the Discogs.data cache counters and refresh schedule.
+
+        The schedule counts entries expiring on each of the next few days,
+        plus those already overdue and those not yet scheduled.
+        """
+        now = datetime.now()
+        stats = dict((event, cache.get(Discogs.CACHE_STATS_KEY % event, 0))
+                     for event in ['hit', 'miss', 'stale'])
+
+        schedule = dict(((now + timedelta(days=i)).date(), 0) for i in range(days))
+        for expires in self.filter(data_cache_expires__gte=now,
+                                   data_cache_expires__lt=now + timedelta(days=days),
+                                  ).values_list('data_cache_expires', flat=True):
+            schedule[expires.date()] = schedule.get(expires.date(), 0) + 1
+
+        stats['schedule'] = sorted(schedule.items())
+        stats['overdue'] = self.filter(data_cache_expires__lt=now).count()
+        stats['unscheduled'] = self.filter(data_cache_expires=None).count()
+        stats['refreshing'] = DiscogsQueueItem.objects.filter(
+                                object_type=DiscogsQueueItem.REFRESH,
+                                state=DiscogsQueueItem.STATE_WAITING).count()
+        return stats
+
 class Discogs(models.Model):
     "Holds a relationship with Discogs."
     ARTIST = 1
@@ -128,9 +303,16 @@ class Discogs(models.Model):
     object_id = models.CharField(max_length=255)
     data_cache = models.TextField(blank=True, null=True)
     data_cache_dttm = models.DateTimeField(blank=True, null=True, verbose_name='data cache timestamp')
+    data_cache_expires = models.DateTimeField(blank=True, null=True, db_index=True,
+                                              verbose_name='data cache expiry')
 
     objects = DiscogsManager()
 
+    CACHE_STATS_KEY = __name__ + '.Discogs.data.%s'
+
+    _parsed = None
+    _parsed_key = None
+
     class Meta:
         ordering = ('object_type', 'object_id',)
         unique_together = (('object_type', 'object_id',),)
@@ -144,8 +326,14 @@ class Discogs(models.Model):
 
     @property
     def discogs_object(self):
+        return self.get_discogs_object()
+
+    def get_discogs_object(self, client=None):
+        if client is None:
+            client = discogs
+
         if self.object_type == self.ARTIST_RAWID:
-            class Artists(discogs.Artist):
+            class Artists(client.Artist):
                 _uri_name = 'artists'
 
                 @property
@@ -163,42 +351,483 @@ class Discogs(models.Model):
                         return release_json
                     else:
                         status_code = self._response.status_code
-                        raise discogs.DiscogsAPIError('http error %d' % status_code)
+                        raise client.DiscogsAPIError('http error %d' % status_code)
 
             discogs_obj = Artists
         else:
-            discogs_obj = getattr(discogs, self.get_object_type_display())
+            discogs_obj = getattr(client, self.get_object_type_display())
         return discogs_obj(self.object_id)
 
     @property
     def data(self):
+        """Returns the cached Discogs payload, without waiting on Discogs.
+
+        Stale or missing payloads are queued for the background worker
+        to refresh; until then, readers get the last good payload.
+        """
         if self.object_type == self.SEARCH:
             return None
-        if (not self.data_cache_dttm) or (self.data_cache_dttm < datetime.now() - timedelta(days=30)):
-            # nuke existing cache
-            self.data_cache = None
-            self.data_cache_dttm = None
-            self.save()
-            try:
-                # read in new stuff from discogs
-                self.data_cache = json.dumps(self.discogs_object.data)
-                self.data_cache_dttm = datetime.now()
-            except BaseException, e:
-                logger.exception(e)
-                self.data_cache = None
-                self.data_cache_dttm = None
-            self.save()
 
         if self.data_cache is None:
+            self._count_cache_event('miss')
+            self.request_refresh()
             return None
 
-        return json.loads(self.data_cache)
+        if self._parsed_key != self._get_parsed_key():
+            # First look at this payload through this instance
+            expires = self.cache_expires
+            if expires is None or expires < datetime.now():
+                self._count_cache_event('stale')
+                self.request_refresh()
+            else:
+                self._count_cache_event('hit')
+
+        return self.parsed_data_cache
+
+    @property
+    def parsed_data_cache(self):
+        """Returns data_cache decoded, without any freshness checks.
+
+        Decoded payloads are shared with other readers in this process,
+        so treat them as read-only.
+        """
+        if self.data_cache is None:
+            return None
+
+        key = self._get_parsed_key()
+        if self._parsed_key != key:
+            parsed = None
+            if self.pk:
+                parsed = _parsed_payloads.get(key)
+            if parsed is None:
+                parsed = json.loads(self.data_cache)
+                if self.pk:
+                    _parsed_payloads.set(key, parsed)
+            self._parsed = parsed
+            self._parsed_key = key
+        return self._parsed
+
+    def _get_parsed_key(self):
+        return (self.pk, self.data_cache_dttm)
+
+    def _forget_parsed(self):
+        self._parsed = self._parsed_key = None
+        if self.pk:
+            _parsed_payloads.discard(lambda key: key[0] == self.pk)
+
+    def save(self, *args, **kwargs):
+        self._forget_parsed()
+        super(Discogs, self).save(*args, **kwargs)
+
+    @property
+    def cache_expires(self):
+        "When the cached payload should be refreshed."
+        if self.data_cache_expires:
+            return self.data_cache_expires
+        if self.data_cache_dttm:
+            # Predates scheduled expiry; spread it out by pk.
+            return self.data_cache_dttm + self._get_cache_ttl(random.Random(self.pk))
+        return None
+
+    def _get_cache_ttl(self, rng=random):
+        jitter = DISCOGS_CACHE_JITTER * rng.uniform(-1, 1)
+        return timedelta(days=DISCOGS_CACHE_DAYS * (1 + jitter))
+
+    def _count_cache_event(self, event):
+        key = self.CACHE_STATS_KEY % event
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, None)
+
+    def set_data(self, data):
+        "Stores a fresh payload and schedules its next refresh."
+        now = datetime.now()
+        self.data_cache = json.dumps(data)
+        self.data_cache_dttm = now
+        self.data_cache_expires = now + self._get_cache_ttl()
+
+    def refresh(self, client=None, throttle=None):
+        """Fetches a new payload from Discogs and saves it.
+
+        If Discogs cannot be reached, the last good payload is kept and
+        the exception propagates, as DiscogsUnavailable for errors worth
+        retrying and Discogs.DoesNotExist for other Discogs errors.
+        throttle is called before the request, as for get_for_object().
+        """
+        client = client or discogs
+        try:
+            with discogs_request(throttle):
+                data = self.get_discogs_object(client).data
+        except client.DiscogsAPIError, e:
+            if is_transient_discogs_error(e):
+                raise DiscogsUnavailable(u"Could not refresh {0}: {1}".format(self, e))
+            raise Discogs.DoesNotExist(u"Could not refresh {0}: {1}".format(self, e))
+        self.set_data(data)
+        self.save()
+        for obj in list(self.artist_set.all()) + list(self.album_set.all()):
+            obj.refresh_artwork()
+
+    def request_refresh(self):
+        "Flags this record for the background worker to refresh."
+        if not self.pk:
+            return
+        if cache.add(__name__ + '.Discogs.request_refresh.' + str(self.pk), True, 3600):
+            DiscogsQueueItem.objects.enqueue([self])
 
     def get_asset(self):
         qs = list(self.artist_set.all()) + list(self.album_set.all())
         return qs[0] if qs else None
     get_asset.short_description = 'Asset'
 
+class DiscogsQueueItemManager(models.Manager):
+    def enqueue(self, objs):
+        """Queues Artists and Albums for a background Discogs lookup.
+
+        Discogs records may be queued too, to have their data refreshed.
+
+        Objects already in the queue, or queued meanwhile by another
+        process, are skipped, so this usually costs one query to find them
+        and one to insert the rest.  Returns the number of new queue items.
+        """
+        wanted = set()
+        for obj in objs:
+            if type(obj) is Artist:
+                wanted.add((DiscogsQueueItem.ARTIST, obj.pk))
+            elif type(obj) is Album:
+                wanted.add((DiscogsQueueItem.ALBUM, obj.pk))
+            elif type(obj) is Discogs:
+                wanted.add((DiscogsQueueItem.REFRESH, obj.pk))
+        if not wanted:
+            return 0
+
+        q = Q()
+        for obj_type, obj_id in wanted:
+            q |= Q(object_type=obj_type, object_id=obj_id)
+        wanted -= set(self.filter(q).values_list('object_type', 'object_id'))
+
+        return bulk_create_new(self, [DiscogsQueueItem(object_type=obj_type, object_id=obj_id)
+                                      for obj_type, obj_id in wanted])
+
+    def get_due(self):
+        "Returns the waiting items whose next attempt is due."
+        return self.filter(state=DiscogsQueueItem.STATE_WAITING,
+                           next_attempt__lte=datetime.now()).order_by('next_attempt', 'pk')
+
+class DiscogsQueueItem(models.Model):
+    "An Artist or Album waiting for a Discogs lookup."
+    ARTIST = 1
+    ALBUM = 2
+    REFRESH = 3
+    OBJECT_TYPE_CHOICES = (
+        (ARTIST, 'Artist'),
+        (ALBUM, 'Album'),
+        (REFRESH, 'Discogs refresh'),
+    )
+
+    STATE_WAITING = 'waiting'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = (
+        (STATE_WAITING, 'Waiting for lookup'),
+        (STATE_FAILED, 'Lookup failed'),
+    )
+
+    object_type = models.PositiveSmallIntegerField(choices=OBJECT_TYPE_CHOICES)
+    object_id   = models.PositiveIntegerField()
+    state       = models.CharField(max_length=10, choices=STATE_CHOICES,
+                                   default=STATE_WAITING)
+    attempts    = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=datetime.now, db_index=True)
+    last_error  = models.TextField(blank=True)
+    created     = models.DateTimeField(auto_now_add=True)
+    modified    = models.DateTimeField(auto_now=True)
+
+    objects = DiscogsQueueItemManager()
+
+    class Meta:
+        ordering = ('next_attempt', 'pk',)
+        unique_together = (('object_type', 'object_id',),)
+        verbose_name = 'discogs queue item'
+
+    def __unicode__(self):
+        return u"{0} {1} ({2})".format(
+            self.get_object_type_display(),
+            self.object_id,
+            self.get_state_display(),
+        )
+
+    def get_object(self):
+        "Returns the Artist, Album or Discogs to look up, or None if it is gone."
+        model = {
+            self.ARTIST: Artist,
+            self.ALBUM: Album,
+            self.REFRESH: Discogs,
+        }[self.object_type]
+        try:
+            return model._base_manager.get(pk=self.object_id)
+        except model.DoesNotExist:
+            return None
+
+class CachedInspection(object):
+    """
+    Stands in for an Inspector, with what an InspectionResult remembers.
+
+    Embedded artwork isn't kept, so artwork is always empty.
+    """
+    def __init__(self, result):
+        self.__dict__.update(json.loads(result.tags))
+        self.mimetype = result.mimetype
+        self.bitrate = result.bit_rate
+        self.samplerate = result.sample_rate
+        self.length = result.length
+        self.is_vbr = result.is_vbr
+        self.lossy = result.lossy
+        self.artwork = []
+
+class InspectionResultManager(models.Manager):
+    def get_fingerprint(self, fieldfile):
+        """Returns a (fingerprint, size) pair identifying a stored file's contents.
+
+        Files in S3 use their ETag.  Other storages use the modification
+        time, which changes whenever the file is rewritten; this avoids
+        reading files just to hash them.  As that says nothing about the
+        contents, the file's name goes into the fingerprint too, so other
+        files never share its InspectionResult.
+        """
+        f = fieldfile.storage.open(fieldfile.name, 'rb')
+        try:
+            key = getattr(f, 'key', None)
+            if key is not None:
+                return 'etag:' + key.etag.strip('"'), key.size
+        finally:
+            f.close()
+        modified = fieldfile.storage.modified_time(fieldfile.name)
+        return ('mtime:%s:%x' % (hashlib.sha1(force_bytes(fieldfile.name)).hexdigest(),
+                                 (modified - datetime(1970, 1, 1)).total_seconds() * 1e6),
+                fieldfile.storage.size(fieldfile.name))
+
+    def describe(self, inspobj):
+        "Returns the InspectionResult field values for an Inspector, without saving."
+        return {
+            'mimetype': inspobj.mimetype or '',
+            'tags': json.dumps(dict((field, getattr(inspobj, field, None))
+                                    for field in INSPECTION_TAGS)),
+            'bit_rate': getattr(inspobj, 'bitrate', None),
+            'sample_rate': getattr(inspobj, 'samplerate', None),
+            'length': getattr(inspobj, 'length', None),
+            'is_vbr': getattr(inspobj, 'is_vbr', None),
+            'lossy': getattr(inspobj, 'lossy', None),
+            'artwork': json.dumps([{
+                    'sha1': hashlib.sha1(apic['data']).hexdigest(),
+                    'mimetype': apic['mimetype'],
+                    'size': len(apic['data']),
+                } for apic in getattr(inspobj, 'artwork', [])]),
+        }
+
+    def store(self, fingerprint, size, inspobj):
+        "Saves what an Inspector found in a file.  Returns the InspectionResult."
+        result, created = self.get_or_create(fingerprint=fingerprint, size=size,
+                                             defaults=self.describe(inspobj))
+        return result
+
+    def inspect(self, assetfile, fingerprint=None, inspobj=None):
+        """Returns an Inspector, or a CachedInspection, for an AssetFile.
+
+        Files whose contents were inspected before aren't read again,
+        unless they carry artwork that their Track doesn't have yet.
+        Pass inspobj to remember an Inspector already run on the file;
+        it is taken as is if the AssetFile is already linked to a result.
+        Links the AssetFile to its InspectionResult.
+        """
+        if inspobj is not None and assetfile.inspection_id is not None:
+            return inspobj
+        fingerprint, size = fingerprint or self.get_fingerprint(assetfile.contents)
+        result = None
+        if inspobj is None:
+            try:
+                result = self.get(fingerprint=fingerprint, size=size)
+                inspobj = CachedInspection(result)
+                if result.get_artwork() and not Track.artwork.through.objects.filter(
+                        track=assetfile.asset_id).exists():
+                    inspobj = None
+            except InspectionResult.DoesNotExist:
+                pass
+
+        if inspobj is None:
+            contents = open_ranged(assetfile.contents)
+            try:
+                inspobj = Inspector(contents, assetfile.mimetype)
+            finally:
+                contents.close()
+        if result is None:
+            result = self.store(fingerprint, size, inspobj)
+
+        if assetfile.inspection_id != result.pk:
+            AssetFile.objects.filter(pk=assetfile.pk).update(inspection=result)
+            assetfile.inspection = result
+        return inspobj
+
+class InspectionResult(models.Model):
+    """
+    What Inspector found in a file, keyed by a fingerprint of its contents.
+
+    Lets unchanged files skip inspection, and identical files share it.
+    """
+    fingerprint = models.CharField(max_length=64)
+    size        = models.BigIntegerField()
+    mimetype    = models.CharField(max_length=255, blank=True, verbose_name="MIME type")
+    tags        = models.TextField(blank=True, default='{}')
+    bit_rate    = models.FloatField(blank=True, null=True)
+    sample_rate = models.FloatField(blank=True, null=True)
+    length      = models.FloatField(blank=True, null=True)
+    is_vbr      = models.NullBooleanField(blank=True, null=True,
+                                          verbose_name="variable bit rate")
+    lossy       = models.NullBooleanField(blank=True, null=True)
+    artwork     = models.TextField(blank=True, default='[]',
+                                   help_text="SHA-1, MIME type and size of embedded pictures")
+    created     = models.DateTimeField(auto_now_add=True)
+
+    objects = InspectionResultManager()
+
+    class Meta:
+        unique_together = (('fingerprint', 'size',),)
+
+    def __unicode__(self):
+        return u"{0} ({1} bytes)".format(self.fingerprint, self.size)
+
+    def get_tags(self):
+        return json.loads(self.tags)
+
+    def get_artwork(self):
+        return json.loads(self.artwork)
+
+def make_thumbnail(data):
+    """Returns (JPEG thumbnail, width, height) for image data.
+
+    The sizes are the original image's.  Returns None if PIL isn't
+    installed or can't read the image.
+    """
+    if Image is None:
+        return None
+    try:
+        image = Image.open(StringIO(data))
+        width, height = image.size
+        image.thumbnail((ARTWORK_THUMBNAIL_SIZE, ARTWORK_THUMBNAIL_SIZE), Image.ANTIALIAS)
+        out = StringIO()
+        image.convert('RGB').save(out, 'JPEG', quality=ARTWORK_THUMBNAIL_QUALITY)
+    except (IOError, ValueError), e:
+        logger.warning(u"Could not make a thumbnail: %s", e)
+        return None
+    return out.getvalue(), width, height
+
+class ArtworkManager(models.Manager):
+    def prepare(self, data, mimetype):
+        """Returns an unsaved Artwork for image data, with its files in storage.
+
+        Files already stored under the image's hash are not uploaded or
+        generated again.  Doesn't use the database.
+        """
+        artwork = self.model(sha1=hashlib.sha1(data).hexdigest(),
+                             mimetype=mimetype, size=len(data))
+        storage = self.model._meta.get_field('image').storage
+
+        name = _get_artwork_path(artwork, artwork.sha1 + (get_extension(mimetype) or ''))
+        artwork.image = name if storage.exists(name) else storage.save(name, ContentFile(data))
+
+        name = _get_artwork_path(artwork, artwork.sha1 + '_thumb.jpg')
+        if storage.exists(name):
+            artwork.thumbnail = name
+        else:
+            thumbnail = make_thumbnail(data)
+            if thumbnail is not None:
+                thumbnail_data, artwork.width, artwork.height = thumbnail
+                artwork.thumbnail = storage.save(name, ContentFile(thumbnail_data))
+        return artwork
+
+    def store(self, data, mimetype):
+        "Returns the Artwork for image data, storing it if it is new."
+        sha1 = hashlib.sha1(data).hexdigest()
+        try:
+            return self.get(sha1=sha1)
+        except Artwork.DoesNotExist:
+            pass
+        return self.save_prepared(self.prepare(data, mimetype))
+
+    def for_url(self, url):
+        "Returns the Artwork for an image served from url, such as a Discogs image."
+        artwork, created = self.get_or_create(source_url=url, defaults={
+            'mimetype': mimetypes.guess_type(url)[0] or 'image/jpeg',
+            'size': 0,
+        })
+        return artwork
+
+    def for_assetfile(self, assetfile):
+        """Returns Artwork showing a picture extracted onto its own AssetFile
+        before Artwork existed, in place.  dedupe_artwork replaces it.
+        """
+        artwork, created = self.get_or_create(sha1=None, image=assetfile.contents.name,
+                                              defaults={'mimetype': assetfile.mimetype, 'size': 0})
+        return artwork
+
+    def from_discogs(self, discogs_objs):
+        """Returns Artwork for the best image in some Discogs records, or None.
+
+        The first primary image wins; failing that, the first image.
+        """
+        pickings = []
+        for discogs in discogs_objs:
+            data = discogs.data if discogs else None
+            if data and 'images' in data:
+                for img in data['images']:
+                    localpath = reverse('discogs_image',
+                        args=(urlparse(img['resource_url']).path,),)
+                    if img['type'] == 'primary':
+                        return self.for_url(localpath)
+                    pickings.append(localpath)
+        if pickings:
+            return self.for_url(pickings[0])
+        return None
+
+    def save_prepared(self, artwork):
+        "Saves an Artwork from prepare(), or returns the one saved first."
+        try:
+            with transaction.atomic():
+                artwork.save()
+        except IntegrityError:
+            return self.get(sha1=artwork.sha1)
+        return artwork
+
+class Artwork(models.Model):
+    """
+    A cover image, stored once however many files embed it.
+
+    Identified by the SHA-1 of its data.  thumbnail is a small JPEG made
+    when the image is first stored, if PIL is available.  Images found
+    elsewhere, like on Discogs, have a source_url instead of files.
+    """
+    sha1        = models.CharField(max_length=40, unique=True, null=True, blank=True,
+                                   verbose_name="SHA-1")
+    mimetype    = models.CharField(max_length=255, verbose_name="MIME type")
+    size        = models.PositiveIntegerField()
+    width       = models.PositiveIntegerField(blank=True, null=True)
+    height      = models.PositiveIntegerField(blank=True, null=True)
+    image       = models.FileField(upload_to=_get_artwork_path, max_length=255, blank=True)
+    thumbnail   = models.FileField(upload_to=_get_artwork_path, max_length=255, blank=True)
+    source_url  = models.CharField(max_length=255, blank=True, default="", db_index=True,
+                                   verbose_name="source URL")
+    created     = models.DateTimeField(auto_now_add=True)
+
+    objects = ArtworkManager()
+
+    def __unicode__(self):
+        return u"{0} ({1})".format(self.sha1 or self.source_url, self.mimetype)
+
+    def get_url(self):
+        "Returns the thumbnail's URL, or the full image's if there is none."
+        if self.thumbnail or self.image:
+            return (self.thumbnail or self.image).url
+        return self.source_url or None
+
 class Thing(models.Model):
     "Abstract base class for things with names."
     name        = models.CharField(max_length=255)
@@ -212,14 +841,90 @@ class Thing(models.Model):
     def __unicode__(self):
         return self.name
 
+def _skip_maintained_fields(instance, kwargs):
+    """Makes a save() of an instance loaded earlier leave its
+    maintained_fields alone, unless update_fields names them, so that a
+    stale copy can't write back what signal handlers have changed since.
+    """
+    if (instance._state.adding or instance.pk is None or kwargs.get('force_insert')
+            or kwargs.get('update_fields') is not None):
+        return
+    kwargs['update_fields'] = [field.name for field in instance._meta.concrete_fields
+                               if not field.primary_key
+                               and field.name not in instance.maintained_fields]
+
+class _SQLSumOrZero(sql_aggregates.Sum):
+    sql_template = 'COALESCE(%(function)s(%(field)s), 0)'
+
+class SumOrZero(Sum):
+    "Sum that gives 0 rather than None when there is nothing to add up."
+    def add_to_query(self, query, alias, col, source, is_summary):
+        query.aggregates[alias] = _SQLSumOrZero(col, source=source, is_summary=is_summary,
+                                                **self.extra)
+
+# Statistics stored on Asset, and how to count them from scratch.
+ASSET_STATS = {
+    'assetfile_count':  Count('assetfile', distinct=True),
+    'play_count':       Count('play', distinct=True),
+    'last_play':        Max('play__modified'),
+    'average_rating':   Avg('rating__rating'),
+    'rating_count':     Count('rating', distinct=True),
+}
+
+class LiveStatsQuerySet(QuerySet):
+    "Fills in an Asset's statistics from live aggregates instead of its columns."
+    def iterator(self):
+        for obj in super(LiveStatsQuerySet, self).iterator():
+            for field in ASSET_STATS:
+                setattr(obj, field, getattr(obj, 'live_' + field))
+            yield obj
+
 class AssetManager(models.Manager):
-    def get_query_set(self):
-        qs = super(AssetManager, self).get_query_set()
-        return qs.annotate(
-                    assetfile_count=Count('assetfile', distinct=True),
-                    play_count=Count('play', distinct=True),
-                    average_rating=Avg('rating__rating'),
-                    last_play=Max('play__modified'),)
+    def with_live_stats(self):
+        """Returns a QuerySet whose statistics are aggregated from Play,
+        Rating and AssetFile rather than read from the stored columns."""
+        qs = self.get_query_set()._clone(klass=LiveStatsQuerySet)
+        return qs.annotate(**dict(('live_' + field, aggregate)
+                                  for field, aggregate in ASSET_STATS.items()))
+
+    def refresh_stats(self, asset_pks, plays=True, ratings=True, files=True):
+        """Recounts the stored statistics of the given Assets.
+
+        Only the groups asked for are recounted, and only Assets whose
+        numbers changed are written.  Returns the pks that were written.
+        """
+        asset_pks = list(asset_pks)
+        fields = []
+        live = dict((pk, {}) for pk in asset_pks)
+        if plays:
+            fields += ['play_count', 'last_play']
+            for pk in asset_pks:
+                live[pk].update(play_count=0, last_play=None)
+            for row in Play.objects.filter(asset__in=asset_pks).order_by().values('asset').annotate(
+                            play_count=Count('pk'), last_play=Max('modified')):
+                live[row.pop('asset')].update(row)
+        if ratings:
+            fields += ['rating_count', 'average_rating']
+            for pk in asset_pks:
+                live[pk].update(rating_count=0, average_rating=None)
+            for row in Rating.objects.filter(asset__in=asset_pks).order_by().values('asset').annotate(
+                            rating_count=Count('pk'), average_rating=Avg('rating')):
+                live[row.pop('asset')].update(row)
+        if files:
+            fields += ['assetfile_count']
+            for pk in asset_pks:
+                live[pk].update(assetfile_count=0)
+            for row in AssetFile.objects.filter(asset__in=asset_pks).order_by().values('asset').annotate(
+                            assetfile_count=Count('pk')):
+                live[row.pop('asset')].update(row)
+
+        changed = []
+        for row in Asset._base_manager.filter(pk__in=asset_pks).values('pk', *fields):
+            pk = row.pop('pk')
+            if row != live[pk]:
+                Asset._base_manager.filter(pk=pk).update(**live[pk])
+                changed.append(pk)
+        return changed
 
 class Asset(Thing):
     "Inherited class that owns the actual files."
@@ -233,6 +938,16 @@ class Asset(Thing):
     shared_with_all = models.BooleanField(default=False,
                               help_text="May any user access this asset?")
 
+    # Kept current by the Play, Rating and AssetFile signal handlers below;
+    # reconcile_asset_stats repairs any drift.
+    assetfile_count = models.PositiveIntegerField(default=0, editable=False)
+    play_count      = models.PositiveIntegerField(default=0, editable=False)
+    last_play       = models.DateTimeField(blank=True, null=True, editable=False)
+    average_rating  = models.FloatField(blank=True, null=True, editable=False)
+    rating_count    = models.PositiveIntegerField(default=0, editable=False)
+
+    maintained_fields = tuple(ASSET_STATS)
+
     class Meta:
         permissions = (
                        ("can_download_asset", "Can download asset"),
@@ -241,6 +956,15 @@ class Asset(Thing):
 
     objects = AssetManager()
 
+    def save(self, *args, **kwargs):
+        _skip_maintained_fields(self, kwargs)
+        super(Asset, self).save(*args, **kwargs)
+
+    def user_can_stream(self, user):
+        "Returns True if user may stream this asset's files."
+        return (user.has_perm('assets.can_stream_asset')
+                or user.has_perm('assets.can_stream_asset', self))
+
 class AssetFile(Thing):
     "Describes an underlying file for an Asset."
     asset       = models.ForeignKey(Asset)
@@ -248,6 +972,8 @@ class AssetFile(Thing):
     mimetype    = models.CharField(max_length=255, choices=MIMETYPE_CHOICES,
                                    blank=True, verbose_name="MIME type")
     length      = models.FloatField(blank=True, null=True,)
+    inspection  = models.ForeignKey(InspectionResult, blank=True, null=True,
+                                    editable=False, on_delete=models.SET_NULL)
 
     class Meta:
         order_with_respect_to = 'asset'
@@ -258,12 +984,7 @@ class AssetFile(Thing):
     @property
     def filename(self):
         if hasattr(self.asset, 'track') and self.mimetype.startswith('audio'):
-            if self.mimetype == 'audio/mpeg': exten = '.mp3'
-            elif self.mimetype == 'audio/mp4': exten = '.m4a'
-            elif self.mimetype == 'audio/x-flac': exten = '.flac'
-            elif self.mimetype == 'audio/ogg': exten = '.ogg'
-            else: exten = mimetypes.guess_extension(self.mimetype, False)
-            return u"{0}{1}".format(self.asset.track.name, exten)
+            return u"{0}{1}".format(self.asset.track.name, get_extension(self.mimetype))
         else:
             return u"{0}{1}".format(self.name,
                                   mimetypes.guess_extension(
@@ -298,7 +1019,7 @@ class AssetDescriptor(models.Model):
                                    default='application/octet-stream',
                                    verbose_name="MIME type")
 
-    bit_rate    = models.FloatField(blank=True, null=True)
+    bit_rate    = models.FloatField(blank=True, null=True, db_index=True)
     is_vbr      = models.NullBooleanField(blank=True, null=True,
                                           verbose_name="variable bit rate")
     lossy       = models.NullBooleanField(blank=True, null=True)
@@ -307,18 +1028,125 @@ class AssetDescriptor(models.Model):
     class Meta:
         ordering        = ['bitstream']
         unique_together = ('assetfile', 'bitstream')
+        # For picking streams by bit rate; see TrackManager.pick_streams
+        index_together  = [('assetfile', 'mimetype', 'bit_rate')]
 
     def __unicode__(self):
         return u"Stream {bitstream} ({mimetype})".format(**self.__dict__)
 
+class RenditionManager(models.Manager):
+    def request(self, tracks, profile=None):
+        """Queues renditions for Tracks, to be made by transcode_assets.
+
+        Each is made from the track's first lossless file, or else its
+        first audio file.  Tracks that already have a rendition in this
+        profile, made, waiting or failed, are skipped.  Returns the
+        number of new renditions.
+        """
+        profile = profile or TRANSCODE_PROFILE
+        track_pks = set(track.pk for track in tracks)
+        track_pks -= set(self.filter(source__asset__in=track_pks, profile=profile).values_list(
+                            'source__asset', flat=True))
+        if not track_pks:
+            return 0
+
+        lossless = set(AssetDescriptor.objects.filter(assetfile__asset__in=track_pks,
+                            bitstream=0, lossy=False).values_list('assetfile', flat=True))
+        sources = {}
+        for pk, asset_id in AssetFile.objects.filter(asset__in=track_pks,
+                                mimetype__startswith='audio/', rendition__isnull=True).order_by(
+                                '-pk').values_list('pk', 'asset'):
+            if pk in lossless or asset_id not in sources or sources[asset_id] not in lossless:
+                sources[asset_id] = pk
+
+        return bulk_create_new(self, [Rendition(source_id=pk, profile=profile)
+                                      for pk in sources.values()])
+
+    def evict(self, budget=None):
+        """Deletes renditions, least recently played first, until the rest
+        fit in budget bytes.  Returns (renditions deleted, bytes freed).
+        """
+        budget = TRANSCODE_BUDGET if budget is None else budget
+        made = self.filter(state=Rendition.STATE_DONE)
+        total = made.aggregate(total=Sum('size'))['total'] or 0
+        evicted = freed = 0
+        for rendition in made.select_related('assetfile').order_by(
+                            'source__asset__last_play', 'created'):
+            if total <= budget:
+                break
+            # Deleting the file deletes the Rendition with it
+            rendition.assetfile.contents.delete(save=False)
+            rendition.assetfile.delete()
+            total -= rendition.size
+            freed += rendition.size
+            evicted += 1
+        return evicted, freed
+
+class Rendition(models.Model):
+    """
+    An AssetFile transcoded from another, for tracks with nothing players
+    can stream.  Made by transcode_assets and kept while there's room.
+    """
+    STATE_WAITING = 'waiting'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = (
+        (STATE_WAITING, 'Waiting to be transcoded'),
+        (STATE_DONE, 'Transcoded'),
+        (STATE_FAILED, 'Transcoding failed'),
+    )
+
+    source      = models.ForeignKey(AssetFile, related_name='renditions')
+    profile     = models.CharField(max_length=10,
+                                   choices=[(p, p) for p in sorted(TRANSCODE_PROFILES)])
+    assetfile   = models.OneToOneField(AssetFile, null=True, blank=True, editable=False,
+                                       related_name='rendition')
+    state       = models.CharField(max_length=10, choices=STATE_CHOICES,
+                                   default=STATE_WAITING, db_index=True)
+    size        = models.PositiveIntegerField(default=0, editable=False)
+    last_error  = models.TextField(blank=True)
+    created     = models.DateTimeField(auto_now_add=True)
+    modified    = models.DateTimeField(auto_now=True)
+
+    objects = RenditionManager()
+
+    class Meta:
+        unique_together = (('source', 'profile',),)
+
+    def __unicode__(self):
+        return u"{0} of {1} ({2})".format(self.profile, self.source, self.get_state_display())
+
 # Music-specific concepts.
-class ArtistManager(models.Manager):
+class StatsManager(models.Manager):
+    """
+    Manager whose QuerySets are annotated with the aggregates in stats.
+
+    Models using it also get a plain `bare` manager for lookups that only
+    need the rows; with_stats() attaches the aggregates afterward.
+    """
+    stats = {}
+
     def get_query_set(self):
-        qs = super(ArtistManager, self).get_query_set()
-        return qs.annotate(
-                    album_count=Count('track__album', distinct=True),
-                    track_count=Count('track', distinct=True),
-                    play_count=Count('track__play', distinct=True),)
+        qs = super(StatsManager, self).get_query_set()
+        return qs.annotate(**self.stats)
+
+    def with_stats(self, objs):
+        "Attaches the aggregates to objs with one query, and returns them."
+        objs = list(objs)
+        rows = self.model.bare.filter(pk__in=[o.pk for o in objs]
+                    ).order_by().values('pk').annotate(**self.stats)
+        rows = dict((row.pop('pk'), row) for row in rows)
+        for obj in objs:
+            for name, value in rows.get(obj.pk, {}).items():
+                setattr(obj, name, value)
+        return objs
+
+class ArtistManager(StatsManager):
+    stats = {
+        'album_count':  Count('track__album', distinct=True),
+        'track_count':  Count('track', distinct=True),
+        'play_count':   SumOrZero('track__play_count'),
+    }
 
 class Artist(Thing):
     "A performing artist."
@@ -329,10 +1157,16 @@ class Artist(Thing):
     discogs     = models.ForeignKey(Discogs, null=True, blank=True, on_delete=models.SET_NULL)
 
     objects     = ArtistManager()
+    bare        = models.Manager()
 
     def __unicode__(self):
         return u"O(+>" if self.is_prince else self.name
 
+    def refresh_artwork(self):
+        "Picks the primary artwork of this artist's tracks again."
+        for track in self.track_set.select_related('album'):
+            track.refresh_primary_artwork()
+
     def get_track_admin_links(self):
         def __album_print(album, tracks=None):
             out = u'<h4><a href="{url}">{album}</a>{wholealbum}</h4>'.format(
@@ -363,15 +1197,19 @@ class Artist(Thing):
         out = [u'<ul>']
 
         direct = self.track_set.values('album').order_by('album').distinct()
+        extra_albums = Album.bare.filter(extra_artists=self).values('pk').order_by('name').distinct()
+        extra_tracks = self.track_credits.values('pk', 'album__name', 'album__pk').order_by('album__name', 'track_number').distinct()
+        seen_albums = []
+
+        albums = Album.bare.in_bulk(set([a['album'] for a in direct] +
+                                        [a['pk'] for a in extra_albums] +
+                                        [t['album__pk'] for t in extra_tracks]))
+
         if len(direct) > 0:
             out.append(u'<h3>As primary artist</h3>')
             for album in direct:
-                album = Album.objects.get(pk=album['album'])
-                out.append(__album_print(album, tracks=self.track_set.filter(album=album).order_by('disc_number', 'track_number')))
-
-        extra_albums = self.album_credits.values('pk').order_by('name').distinct()
-        extra_tracks = self.track_credits.values('pk', 'album__name', 'album__pk').order_by('album__name', 'track_number').distinct()
-        seen_albums = []
+                album = albums[album['album']]
+                out.append(__album_print(album, tracks=self.track_set.filter(album=album).select_related('artist').order_by('disc_number', 'track_number')))
 
         if len(extra_tracks) > 0 or len(extra_albums) > 0:
             out.append(u'<h3>As credited artist</h3>')
@@ -379,15 +1217,15 @@ class Artist(Thing):
             for extra_track in extra_tracks:
                 if extra_track['album__pk'] in seen_albums:
                     continue
-                album = Album.objects.get(pk=extra_track['album__pk'])
+                album = albums[extra_track['album__pk']]
                 seen_albums.append(album.pk)
-                out.append(__album_print(album, tracks=self.track_credits.filter(album=album).order_by('disc_number', 'track_number')))
+                out.append(__album_print(album, tracks=self.track_credits.filter(album=album).select_related('artist').order_by('disc_number', 'track_number')))
 
             for extra_album in extra_albums:
                 if extra_album['pk'] in seen_albums:
                     continue
-                album = Album.objects.get(pk=extra_album['pk'])
-                out.append(__album_print(album, tracks=self.track_credits.filter(album=album).order_by('disc_number', 'track_number')))
+                album = albums[extra_album['pk']]
+                out.append(__album_print(album, tracks=self.track_credits.filter(album=album).select_related('artist').order_by('disc_number', 'track_number')))
 
         out.append(u'</ul>')
 
@@ -398,13 +1236,12 @@ class Artist(Thing):
     get_track_admin_links.allow_tags = True
     get_track_admin_links.short_description = 'Tracks'
 
-class AlbumManager(models.Manager):
-    def get_query_set(self):
-        qs = super(AlbumManager, self).get_query_set()
-        return qs.annotate(
-                    artist_count=Count('track__artist', distinct=True),
-                    track_count=Count('track', distinct=True),
-                    play_count=Count('track__play', distinct=True),)
+class AlbumManager(StatsManager):
+    stats = {
+        'artist_count': Count('track__artist', distinct=True),
+        'track_count':  Count('track', distinct=True),
+        'play_count':   SumOrZero('track__play_count'),
+    }
 
 class Album(Thing):
     """
@@ -422,8 +1259,45 @@ class Album(Thing):
     extra_artists   = models.ManyToManyField(Artist, null=True, blank=True,
                         related_name="album_credits",
                         help_text="Additional credited artists for this album, such as remixer, producer, etc.")
+    primary_artwork = models.ForeignKey(Artwork, null=True, blank=True, editable=False,
+                        on_delete=models.SET_NULL, related_name='+')
+
+    maintained_fields = ('primary_artwork',)
 
     objects = AlbumManager()
+    bare    = models.Manager()
+
+    def save(self, *args, **kwargs):
+        _skip_maintained_fields(self, kwargs)
+        super(Album, self).save(*args, **kwargs)
+
+    def refresh_primary_artwork(self):
+        """Picks the album's artwork: the picture most of its tracks embed,
+        else its Discogs image.  Returns True if that changed.
+        """
+        embedded = Track.artwork.through.objects.filter(track__album=self).values(
+                        'artwork').annotate(tracks=Count('track')).order_by('-tracks', 'artwork')[:1]
+        if embedded:
+            artwork_id = embedded[0]['artwork']
+        else:
+            artwork = Artwork.objects.from_discogs([self.discogs])
+            artwork_id = artwork.pk if artwork else None
+        if artwork_id == self.primary_artwork_id:
+            return False
+        Album.bare.filter(pk=self.pk).update(primary_artwork=artwork_id)
+        self.primary_artwork_id = artwork_id
+        return True
+
+    def refresh_artwork(self):
+        """Picks the album's primary artwork again, and its tracks' if it changed.
+
+        Returns True if it changed.
+        """
+        if not self.refresh_primary_artwork():
+            return False
+        for track in self.track_set.select_related('album', 'artist__discogs'):
+            track.refresh_primary_artwork()
+        return True
 
     def get_track_admin_links(self):
         out = u'<ul>'
@@ -451,68 +1325,59 @@ class Album(Thing):
 
     @property
     def streamable_tracks(self):
-        winners = []
-        for t in self.tracks:
-            try:
-                t.get_streamable_assetfile()
-                winners.append(t)
-            except:
-                continue
+        "This album's tracks that can be streamed, with their files and URLs looked up at once."
+        tracks = list(self.tracks.filter(streamable_file__isnull=False).select_related(
+                    'artist', 'album', 'streamable_file'))
+        prefetch_urls(track.streamable_file.contents for track in tracks)
+        return tracks
 
-        return winners
 
+class TrackManager(AssetManager):
 
-class TrackManager(models.Manager):
-    def get_query_set(self):
-        qs = super(TrackManager, self).get_query_set()
-        return qs.annotate(
-                    assetfile_count=Count('assetfile', distinct=True),
-                    play_count=Count('play', distinct=True),
-                    average_rating=Avg('rating__rating'),
-                    last_play=Max('play__modified'),)
-
-
-    def create_from_file(self, stash, name=None, album=None, artist=None):
-        if not isinstance(stash, file):
-            filename = stash
-            stash = open(stash)
-        else:
-            filename = getattr(stash, 'name', 'input_file')
-
-        inspfp = NamedTemporaryFile(suffix=os.path.splitext(filename)[1])
-        inspfp.write(stash.read())
-        stash.seek(0)
-        inspfp.seek(0)
-        inspobj = Inspector(fileobj=inspfp)
+    def iter_import_files(self, stash):
+        """Yields (file, Inspector) for each importable file in stash.
 
-        files = []
+        stash must be seekable.  An audio file is inspected in place and
+        yielded as is.  Zip members are streamed, one at a time, into a
+        spooled temporary file that is closed once the caller moves on,
+        so nothing is read whole into memory or copied twice.
+        """
+        inspobj = Inspector(fileobj=stash)
 
         if inspobj.mimetype == 'application/zip':
             myzip = zipfile.ZipFile(stash)
-            count = 0
-            for member in myzip.namelist():
-                # We could just use ZipFile.open, but we need to
-                # be able to seek.
-                if member.endswith('/'):
+            for info in myzip.infolist():
+                if info.filename.endswith('/'):
                     continue
-                mytarget = NamedTemporaryFile()
-                mytarget.write(myzip.read(member))
-                mytarget.seek(0)
-                myinspfp = NamedTemporaryFile()
-                myinspfp.write(mytarget.read())
-                myinspobj = Inspector(fileobj=myinspfp)
-                mytarget.seek(0)
-                files.append((mytarget, myinspobj))
-                count += 1
-        elif inspobj.mimetype.startswith('audio/'):
+                spool = SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+                try:
+                    member = myzip.open(info)
+                    shutil.copyfileobj(member, spool, IMPORT_CHUNK_BYTES)
+                    member.close()
+                    spool.seek(0)
+                    # mutagen needs to seek, which ZipExtFile can't do
+                    myfile = InspectableFile(spool, name=os.path.basename(info.filename))
+                    yield myfile, Inspector(fileobj=myfile)
+                finally:
+                    spool.close()
+        elif inspobj.mimetype and inspobj.mimetype.startswith('audio/'):
             stash.seek(0)
-            files.append((stash, inspobj))
+            yield stash, inspobj
         else:
-            raise Exception('Could not figure out what to do with {0} of type {1}.'.format(filename, inspobj.mimetype))
+            raise ValueError('Could not figure out what to do with {0} of type {1}.'.format(
+                getattr(stash, 'name', 'input file'), inspobj.mimetype))
+
+    def create_from_file(self, stash, name=None, album=None, artist=None):
+        if isinstance(stash, basestring):
+            stash = open(stash, 'rb')
+            try:
+                return self.create_from_file(stash, name, album, artist)
+            finally:
+                stash.close()
 
         results = []
 
-        for f, i in files:
+        for f, i in self.iter_import_files(stash):
             if artist:
                 i.artist = artist
             if album:
@@ -531,13 +1396,13 @@ class TrackManager(models.Manager):
                 results.append(None)
                 continue
 
-            art, cre = Artist.objects.get_or_create(
+            art, cre = Artist.bare.get_or_create(
                 name__iexact=i.artist,
                 defaults={
                     'name': i.artist,
                 },
             )
-            alb, cre = Album.objects.get_or_create(
+            alb, cre = Album.bare.get_or_create(
                 name__iexact=i.album,
                 defaults={
                     'name': i.album,
@@ -562,36 +1427,85 @@ class TrackManager(models.Manager):
                 mimetype=i.mimetype,
             )
 
-            t._inspect_files(qs=t.assetfile_set.filter(pk=af.pk))
+            t._inspect_files(qs=t.assetfile_set.filter(pk=af.pk), inspected={af.pk: i})
             results.append(t)
 
         return results
 
+    def pick_streams(self, tracks, max_bit_rate):
+        """Picks the streamable file with the highest bit rate within
+        max_bit_rate (bits/s) for each of the given Tracks, or else the
+        lowest there is, with one query.
+
+        Files whose descriptors don't know their bit rate are passed
+        over.  The picks are remembered on the Tracks for
+        get_streaming_url() and get_streaming_exten().
+        """
+        tracks = list(tracks)
+        candidates = {}
+        for descriptor in AssetDescriptor.objects.filter(
+                            assetfile__asset__in=[track.pk for track in tracks],
+                            mimetype__in=STREAMING_MIMETYPES, bitstream=0,
+                            bit_rate__isnull=False).select_related('assetfile').order_by(
+                            'bit_rate', 'assetfile'):
+            candidates.setdefault(descriptor.assetfile.asset_id, []).append(descriptor)
+
+        picked = []
+        for track in tracks:
+            pick = None
+            found = candidates.get(track.pk)
+            if found:
+                within = [d for d in found if d.bit_rate <= max_bit_rate]
+                # Highest within the limit, first file first; else the lowest
+                best = max(within, key=lambda d: (d.bit_rate, -d.assetfile_id)) if within else found[0]
+                pick = (best.assetfile, STREAMING_MIMETYPES[best.mimetype])
+                picked.append(best.assetfile.contents)
+            track.__dict__.setdefault('_bit_rate_picks', {})[max_bit_rate] = pick
+        prefetch_urls(picked)
+        return tracks
+
+    def refresh_streamable(self, track_pks):
+        """Picks the file to stream for each of the given Tracks again.
+
+        The first file, by pk, with a streamable extension wins.  Only
+        Tracks whose choice changed are written.  Returns their pks.
+        """
+        track_pks = list(track_pks)
+        best = {}
+        for pk, asset_id, name in AssetFile.objects.filter(asset__in=track_pks).order_by(
+                                        '-pk').values_list('pk', 'asset', 'contents'):
+            ext = os.path.splitext(name.lower())[1]
+            if ext in STREAMING_FORMATS:
+                best[asset_id] = (pk, STREAMING_FORMATS[ext])
+
+        changed = []
+        for row in Track._base_manager.filter(pk__in=track_pks).values(
+                        'pk', 'streamable_file', 'streaming_format'):
+            pk = row['pk']
+            streamable_file, streaming_format = best.get(pk, (None, ''))
+            if (row['streamable_file'], row['streaming_format']) != (streamable_file, streaming_format):
+                Track._base_manager.filter(pk=pk).update(
+                    streamable_file=streamable_file, streaming_format=streaming_format)
+                changed.append(pk)
+        return changed
+
     def _get_shuffle_sample(self, user):
         "Returns a sampling of a QuerySet."
         qssample = cache.get('get_shuffle__sample__%i' % user.pk)
         if not qssample:
-            qs = self.get_query_set().filter(skip_random=False)
-            qs = qs.filter(
-                    Q(owner=user) | Q(shared_with=user) |
-                    Q(shared_with_all=True))   # assets we may enjoy
-            qs = qs.annotate(anno_rate=Avg('rating__rating'))
-            qs = qs.annotate(anno_last=Max('play__modified'))
-            qs = qs.filter(
-                Q(anno_last=None) |
-                Q(anno_rate=None,   anno_last__lt=datetime.now() - playtime(None)) |
-                Q(anno_rate__lte=1, anno_last__lt=datetime.now() - playtime(1)) |
-                Q(anno_rate__gt=1,  anno_last__lt=datetime.now() - playtime(2)) |
-                Q(anno_rate__gt=2,  anno_last__lt=datetime.now() - playtime(3)) |
-                Q(anno_rate__gt=3,  anno_last__lt=datetime.now() - playtime(4)) |
-                Q(anno_rate__gt=4,  anno_last__lt=datetime.now() - playtime(5))
-            )
+            # Draw from the user's precomputed pool of eligible tracks
+            pks = ShuffleCandidate.objects.get_sample(user, 400)
+            if not pks and not ShuffleCandidate.objects.filter(user=user).exists():
+                ShuffleCandidate.objects.rebuild_for_user(user)
+                pks = ShuffleCandidate.objects.get_sample(user, 400)
+            tracks = dict((t.pk, t) for t in self.get_query_set().filter(pk__in=pks))
 
             # Filter the sample somewhat to avoid over-representation
             seen_albums = {}
             seen_artists = {}
             qssample = []
-            for t in qs.order_by('?').iterator():
+            for t in [tracks[pk] for pk in pks if pk in tracks]:
+                t.anno_rate = t.average_rating
                 seen_albums[t.album_id] = seen_albums.get(t.album_id, 0) + 1
                 seen_artists[t.artist_id] = seen_artists.get(t.artist_id, 0) + 1
                 if seen_albums[t.album_id] < 5 and seen_artists[t.artist_id] < 5:
@@ -600,6 +1514,35 @@ class TrackManager(models.Manager):
             cache.set('get_shuffle__sample__%i' % user.pk, qssample, 3600)
         return qssample
 
+    def _get_shuffle_scorer(self, user):
+        "Returns a ShuffleScorer over the user's candidate pool."
+        loaded = _shuffle_scorers.get(user.pk)
+        if loaded is None or loaded[0] < time.time() - SHUFFLE_SCORER_TTL:
+            if not ShuffleCandidate.objects.filter(user=user).exists():
+                ShuffleCandidate.objects.rebuild_for_user(user)
+            scorer = shuffle.ShuffleScorer.from_rows(
+                ShuffleCandidate.objects.filter(user=user).values_list(
+                    'track_id', 'track__album_id', 'track__artist_id',
+                    'rating_bucket', 'eligible_after'))
+            loaded = (time.time(), scorer)
+            _shuffle_scorers.set(user.pk, loaded)
+        return loaded[1]
+
+    def _get_scored_shuffle(self, user, mode, grooves, antigrooves):
+        "Picks a shuffle track with the vectorized scorer, or returns None."
+        picks = self._get_shuffle_scorer(user).draw(
+                    SHUFFLE_BATCH, mode=mode, grooves=grooves,
+                    antigrooves=antigrooves)
+        offered = cache.get_many(['get_shuffle__offered__%i__%i' % (user.pk, pk)
+                                  for pk in picks])
+        for pk in picks:
+            if 'get_shuffle__offered__%i__%i' % (user.pk, pk) not in offered:
+                try:
+                    return self.get_query_set().get(pk=pk)
+                except Track.DoesNotExist:
+                    continue
+        return None
+
     def get_shuffle(self, user, previous=None, debug=False):
         """Returns a shuffle-mode track, with some smarts.
 
@@ -609,50 +1552,48 @@ class TrackManager(models.Manager):
             - Unrated/unplayed tracks: sometimes, go completely random
         """
         randstats = {}
-        if type(previous) is int:
-            previous = self.get(pk=previous)
+        if isinstance(previous, Asset):
+            previous = previous.pk
 
         # Interrogate previous track for good and bad grooves.
         if previous:
-            randstats['previous'] = previous.pk
-            grooves = cache.get('get_shuffle__grooves__%i__%i' % (user.pk, previous.pk))
-            if not grooves:
-                grooves = list(self.get_query_set().filter(
-                    skip_random=False,
-                    play__in_groove=True,
-                    play__previous_play__asset=previous,
-                    play__user=user,
-                ))
-                cache.set('get_shuffle__grooves__%i__%i' % (user.pk, previous.pk), grooves, 7200)
-            antigrooves = cache.get('get_shuffle__antigrooves__%i__%i' % (user.pk, previous.pk))
-            if not antigrooves:
-                antigrooves = list(self.get_query_set().filter(
-                    skip_random=False,
-                    play__in_groove=False,
-                    play__previous_play__asset=previous,
-                    play__user=user,
-                ))
-                cache.set('get_shuffle__antigrooves__%i__%i' % (user.pk, previous.pk), antigrooves, 7200)
+            randstats['previous'] = previous
+            grooves, antigrooves = GrooveEdge.objects.get_grooves(user, previous)
         else:
-            antigrooves = []
-            grooves = []
-
-        qssample = self._get_shuffle_sample(user)
-        qssample.sort(key=lambda k: k.anno_rate)
+            grooves, antigrooves = {}, set()
 
         # Mix this bad boy up.
         val = random.randint(0, 99)
         if val < 25:
             # 25% of the time, be completely random.
-            random.shuffle(qssample)
             randstats['mode'] = 'shuffle'
         elif val < 80:
             # 55% of the time, if there's grooves, put 'em first
-            qssample.extend(grooves)
             randstats['mode'] = 'grooves'
         else:
             randstats['mode'] = 'rating'
 
+        if shuffle.numpy is not None:
+            result = self._get_scored_shuffle(user, randstats['mode'], grooves, antigrooves)
+            if result is not None:
+                randstats.update({
+                    'user_pk': user.pk,
+                    'engine': 'scored',
+                    'antigrooves_len': len(antigrooves),
+                    'grooves_len': len(grooves),
+                })
+                cache.set('get_shuffle__offered__%i__%i' % (user.pk, result.pk), True, 7200)
+                result._randstats = randstats
+                return result
+
+        qssample = self._get_shuffle_sample(user)
+        qssample.sort(key=lambda k: k.anno_rate)
+        if randstats['mode'] == 'shuffle':
+            random.shuffle(qssample)
+        elif randstats['mode'] == 'grooves' and grooves:
+            for track in self.get_query_set().filter(pk__in=grooves, skip_random=False):
+                qssample.extend([track] * grooves[track.pk])
+
         result = None
         iterations = 0
         while result is None:
@@ -670,7 +1611,7 @@ class TrackManager(models.Manager):
                 result = qssample.pop()
                 if (cache.get('get_shuffle__offered__%i__%i' % (user.pk, result.pk)) or
                     result.recently_played or
-                    result in antigrooves
+                    result.pk in antigrooves
                    ): result=None
             else:
                 cache.delete('get_shuffle__sample__%i' % user.pk)
@@ -706,7 +1647,18 @@ class Track(Asset):
     extra_artists   = models.ManyToManyField(Artist, null=True, blank=True,
                         related_name="track_credits",
                         help_text="Additional credited artists for this track, such as producer, special guest, etc.")
+    artwork     = models.ManyToManyField(Artwork, blank=True, related_name='tracks',
+                        help_text="Pictures embedded in this track's files.")
+    primary_artwork = models.ForeignKey(Artwork, null=True, blank=True, editable=False,
+                        on_delete=models.SET_NULL, related_name='+')
 
+    # Kept current by the AssetFile signal handlers below.
+    streamable_file  = models.ForeignKey(AssetFile, null=True, blank=True, editable=False,
+                        on_delete=models.SET_NULL, related_name='+')
+    streaming_format = models.CharField(max_length=8, blank=True, default='', editable=False)
+
+    maintained_fields = Asset.maintained_fields + (
+                            'primary_artwork', 'streamable_file', 'streaming_format')
 
     class Meta:
         order_with_respect_to   = 'album'
@@ -731,41 +1683,86 @@ class Track(Asset):
     get_pretty_track_number.admin_order_field = 'track_number'
 
     def get_artwork_url(self, **kwargs):
-        qs = self.assetfile_set.filter(mimetype__startswith='image/').order_by('?')
-        if qs.exists():
-            return qs[0].contents.url
-        pickings = []
-        for discogs in [self.album.discogs, self.artist.discogs]:
-            if discogs and 'images' in discogs.data:
-                for img in discogs.data['images']:
-                    localpath = reverse('discogs_image',
-                        args=(urlparse(img['resource_url']).path,),)
-                    if img['type'] == 'primary':
-                        return localpath
-                    else:
-                        pickings.append(localpath)
-        if len(pickings) > 0:
-            return random.choice(pickings)
-        return None
+        """Returns the URL of this track's primary artwork, or None.
 
-    def get_streamable_assetfile(self, **kwargs):
-        #ok_extens = ['.mp3', '.m4a', '.spx', '.ogg']
-        ok_extens = ['.mp3', '.m4a']  # :-(
-        for candidate in self.assetfile_set.all():
-            fn = candidate.contents.name.lower()
-            if os.path.splitext(fn)[1] in ok_extens:
-                return candidate
-        raise AssetFile.DoesNotExist("No suitable content found")
-    get_streamable_assetfile.short_description = "Best asset for streaming"
+        select_related('primary_artwork') makes this free of queries.
+        """
+        if self.primary_artwork_id is None:
+            return None
+        return self.primary_artwork.get_url()
 
-    def get_streaming_url(self, **kwargs):
-        "Returns the best URL for this object."
-        return self.get_streamable_assetfile().contents.url
+    def refresh_primary_artwork(self):
+        """Picks this track's artwork: its own embedded picture, else its
+        album's artwork, else its artist's Discogs image.
+        """
+        own = list(self.artwork.order_by('pk').values_list('pk', flat=True)[:1])
+        if not own:
+            own = self._adopt_legacy_artwork()
+        if own:
+            artwork_id = own[0]
+        elif self.album.primary_artwork_id:
+            artwork_id = self.album.primary_artwork_id
+        else:
+            artwork = Artwork.objects.from_discogs([self.artist.discogs])
+            artwork_id = artwork.pk if artwork else None
+        if artwork_id != self.primary_artwork_id:
+            Track.objects.filter(pk=self.pk).update(primary_artwork=artwork_id)
+            self.primary_artwork_id = artwork_id
+
+    def _adopt_legacy_artwork(self):
+        """Links pictures still on their own AssetFiles, from before Artwork
+        existed, as this track's artwork until dedupe_artwork moves them.
+        Returns their Artwork pks.
+        """
+        pks = []
+        for assetfile in self.assetfile_set.filter(mimetype__startswith='image/').order_by('pk'):
+            artwork = Artwork.objects.for_assetfile(assetfile)
+            self.artwork.add(artwork)
+            pks.append(artwork.pk)
+        return pks
+
+    def refresh_artwork(self):
+        "Picks primary artwork again after this track's pictures changed."
+        if not self.artwork.exists():
+            self._adopt_legacy_artwork()
+        self.album.refresh_artwork()
+        self.refresh_primary_artwork()
+
+    def get_streamable_assetfile(self, max_bit_rate=None, **kwargs):
+        """Returns the file to stream, as picked by refresh_streamable().
+
+        select_related('streamable_file') makes this free of queries.
+        Given max_bit_rate (bits/s), returns the streamable file with the
+        highest bit rate within it instead, or else the lowest there is;
+        files whose descriptors don't know their bit rate are passed over.
+        """
+        if max_bit_rate is not None:
+            pick = self._get_bit_rate_pick(max_bit_rate)
+            if pick is not None:
+                return pick[0]
+        if self.streamable_file_id is None:
+            raise AssetFile.DoesNotExist("No suitable content found")
+        return self.streamable_file
+    get_streamable_assetfile.short_description = "Best asset for streaming"
 
-    def get_streaming_exten(self, **kwargs):
-        ext = self.get_streamable_assetfile().contents.name.split('.')[-1:][0]
-        if ext in ['spx', 'ogg']: ext = 'oga'
-        return ext
+    def _get_bit_rate_pick(self, max_bit_rate):
+        "Returns (AssetFile, format) from pick_streams(), picking if need be."
+        if max_bit_rate not in self.__dict__.get('_bit_rate_picks', {}):
+            Track.objects.pick_streams([self], max_bit_rate)
+        return self._bit_rate_picks[max_bit_rate]
+
+    def get_streaming_url(self, max_bit_rate=None, **kwargs):
+        "Returns the best URL for this object, within max_bit_rate if given."
+        return get_stream_url(self.get_streamable_assetfile(max_bit_rate))
+
+    def get_streaming_exten(self, max_bit_rate=None, **kwargs):
+        if max_bit_rate is not None:
+            pick = self._get_bit_rate_pick(max_bit_rate)
+            if pick is not None:
+                return pick[1]
+        if self.streamable_file_id is None:
+            raise AssetFile.DoesNotExist("No suitable content found")
+        return self.streaming_format
 
     def get_recently_played(self):
         "Based on Rating and Play, returns True if track played recently"
@@ -774,21 +1771,29 @@ class Track(Asset):
         return self.last_play > (datetime.now() + playtime(self.average_rating))
     recently_played = property(get_recently_played)
 
-    def _inspect_files(self, qs=None, update_artist=False, update_album=False):
+    def _inspect_files(self, qs=None, update_artist=False, update_album=False, inspected=None):
+        """Updates this Track from the tags in its files.
+
+        inspected maps AssetFile pks to Inspectors already run on their
+        contents, which saves reading those files back from storage.
+        Other files are looked up in the InspectionResult cache first,
+        and what is found is remembered there.
+        """
         if not qs:
             qs = self.assetfile_set.all()
         for assetfile in qs:
-            inspobj = Inspector(assetfile.contents, assetfile.mimetype)
+            inspobj = InspectionResult.objects.inspect(
+                assetfile, inspobj=(inspected or {}).get(assetfile.pk))
 
             if not inspobj.mimetype.startswith('audio/'):
                 continue
 
             if (not self.artist or update_artist) and hasattr(inspobj, 'artist') and inspobj.artist:
-                self.artist, created = Artist.objects.get_or_create(
+                self.artist, created = Artist.bare.get_or_create(
                     name__iexact=inspobj.artist.strip(),
                 )
             if (not self.album or update_album) and hasattr(inspobj, 'album') and inspobj.album:
-                self.album, created = Album.objects.get_or_create(
+                self.album, created = Album.bare.get_or_create(
                     name__iexact=inspobj.album.strip(),
                 )
 
@@ -814,18 +1819,11 @@ class Track(Asset):
             })
 
             for apic in getattr(inspobj, 'artwork', []):
-                # We have a picture!  Extract it onto its own AssetFile.
-                apic_obj_fn = u'APIC-{0}-{1}'.format(
-                    self.pk,
-                    assetfile.pk,
-                )
-                apic_obj, apic_created = AssetFile.objects.get_or_create(
-                    asset = self,
-                    mimetype = apic['mimetype'],
-                    name = apic_obj_fn,
-                )
-                apic_obj.contents.save(apic_obj_fn, ContentFile(apic['data']))
-                apic_obj.save()
+                # We have a picture!  Store it once, however many tracks have it.
+                self.artwork.add(Artwork.objects.store(apic['data'], apic['mimetype']))
+
+        if self.album_id:
+            self.refresh_artwork()
 
 class PlayManager(models.Manager):
     def get_last_play(self, asset):
@@ -924,3 +1922,228 @@ class Rating(models.Model):
             self.rating,
             self.get_rating_display(),
         )
+
+class ShuffleCandidateManager(models.Manager):
+    def get_track_stats(self, track_pks):
+        """Returns {track_pk: (last_play, rating_bucket)} for the given Tracks.
+
+        The rating bucket is the average rating rounded up, which picks
+        the same playtime() window the shuffle has always used.
+        """
+        stats = dict((pk, (None, None)) for pk in track_pks)
+        for pk, last_play, average_rating in Asset._base_manager.filter(
+                pk__in=track_pks).values_list('pk', 'last_play', 'average_rating'):
+            bucket = None
+            if average_rating:
+                bucket = int(math.ceil(average_rating))
+            stats[pk] = (last_play, bucket)
+        return stats
+
+    def _build(self, user_pk, track_pk, last_play, rating_bucket):
+        return ShuffleCandidate(
+            user_id=user_pk,
+            track_id=track_pk,
+            last_play=last_play,
+            rating_bucket=rating_bucket,
+            eligible_after=ShuffleCandidate.get_eligible_after(last_play, rating_bucket),
+            random_key=random.random(),
+        )
+
+    def sync_tracks(self, tracks):
+        "Brings the pool up to date with the visibility of the given Tracks."
+        tracks = list(tracks)
+        stats = self.get_track_stats([t.pk for t in tracks])
+        all_users = None
+        for track in tracks:
+            if track.skip_random:
+                users = set()
+            elif track.shared_with_all:
+                if all_users is None:
+                    all_users = set(User.objects.values_list('pk', flat=True))
+                users = all_users
+            else:
+                users = set(track.shared_with.values_list('pk', flat=True))
+                if track.owner_id:
+                    users.add(track.owner_id)
+
+            existing = set(self.filter(track=track).values_list('user_id', flat=True))
+            if existing - users:
+                self.filter(track=track, user__in=existing - users).delete()
+            self.bulk_create([self._build(user_pk, track.pk, *stats[track.pk])
+                              for user_pk in users - existing])
+
+    def refresh_track(self, track_pk):
+        "Recomputes the last play and rating bucket of a Track after a Play or Rating."
+        last_play, rating_bucket = self.get_track_stats([track_pk])[track_pk]
+        self.filter(track=track_pk).update(
+            last_play=last_play,
+            rating_bucket=rating_bucket,
+            eligible_after=ShuffleCandidate.get_eligible_after(last_play, rating_bucket),
+            random_key=random.random(),
+        )
+
+    def rebuild_for_user(self, user):
+        "Rebuilds a user's whole pool from scratch."
+        self.filter(user=user).delete()
+        tracks = Track._base_manager.filter(skip_random=False).filter(
+                    Q(owner=user) | Q(shared_with=user) |
+                    Q(shared_with_all=True)).values_list('pk', flat=True).distinct()
+        tracks = list(tracks)
+        stats = self.get_track_stats(tracks)
+        self.bulk_create([self._build(user.pk, pk, *stats[pk]) for pk in tracks],
+                         batch_size=500)
+        return len(tracks)
+
+    def get_sample(self, user, size):
+        """Returns the pks of up to size eligible Tracks, in random order.
+
+        Draws a random point in the pool and reads forward along the
+        random_key index, wrapping around if needed.
+        """
+        qs = self.filter(user=user, eligible_after__lte=datetime.now())
+        point = random.random()
+        pks = list(qs.filter(random_key__gte=point).order_by('random_key'
+                    ).values_list('track_id', flat=True)[:size])
+        if len(pks) < size:
+            pks += list(qs.filter(random_key__lt=point).order_by('random_key'
+                    ).values_list('track_id', flat=True)[:size-len(pks)])
+        return pks
+
+class ShuffleCandidate(models.Model):
+    "A Track that a User may hear in shuffle mode, with its eligibility precomputed."
+    user            = models.ForeignKey(User)
+    track           = models.ForeignKey("Track")
+    last_play       = models.DateTimeField(blank=True, null=True)
+    rating_bucket   = models.PositiveSmallIntegerField(blank=True, null=True)
+    eligible_after  = models.DateTimeField()
+    random_key      = models.FloatField()
+
+    objects = ShuffleCandidateManager()
+
+    class Meta:
+        unique_together = (('user', 'track',),)
+        index_together = (('user', 'random_key',),)
+
+    def __unicode__(self):
+        return u"{0} for {1}".format(self.track_id, self.user_id)
+
+    @staticmethod
+    def get_eligible_after(last_play, rating_bucket):
+        "When a Track played at last_play may come up in shuffle again."
+        if last_play is None:
+            return datetime(1970, 1, 1)
+        return last_play + playtime(rating_bucket)
+
+class GrooveEdgeManager(models.Manager):
+    def record(self, play, was=None):
+        """Counts a Play's groove against the track that came before it.
+
+        was is the Play's in_groove value before this change, so that
+        changing your mind moves the count rather than adding to it.
+        """
+        if play.in_groove == was or not play.user_id or not play.previous_play_id:
+            return
+        from_pk = Play.objects.filter(pk=play.previous_play_id
+                    ).values_list('asset_id', flat=True)
+        if not from_pk:
+            return
+
+        edge, created = self.get_or_create(user_id=play.user_id,
+                            from_asset_id=from_pk[0], to_asset_id=play.asset_id)
+        if play.in_groove is not None:
+            field = 'groove_up' if play.in_groove else 'groove_down'
+            self.filter(pk=edge.pk).update(**{field: F(field) + 1})
+        if was is not None:
+            # Plays from before the edges were recorded were never counted;
+            # the columns are unsigned, so leave them at 0 rather than go below
+            field = 'groove_up' if was else 'groove_down'
+            self.filter(pk=edge.pk, **{field + '__gt': 0}).update(**{field: F(field) - 1})
+
+    def get_grooves(self, user, previous):
+        """Returns ({track_pk: times grooved}, set of antigroove track pks)
+        for what followed previous in the user's plays."""
+        grooves = {}
+        antigrooves = set()
+        for to_pk, up, down in self.filter(user=user, from_asset=previous).values_list(
+                                    'to_asset_id', 'groove_up', 'groove_down'):
+            if up > 0:
+                grooves[to_pk] = up
+            if down > 0:
+                antigrooves.add(to_pk)
+        return grooves, antigrooves
+
+    def rebuild(self, users=None):
+        "Recounts edges from Play history, for the given users or everyone."
+        plays = Play.objects.filter(user__isnull=False, in_groove__isnull=False,
+                                    previous_play__isnull=False)
+        edges = self.all()
+        if users is not None:
+            plays = plays.filter(user__in=users)
+            edges = edges.filter(user__in=users)
+
+        counts = {}
+        for row in plays.values('user_id', 'previous_play__asset_id', 'asset_id',
+                                'in_groove').annotate(count=Count('pk')):
+            key = (row['user_id'], row['previous_play__asset_id'], row['asset_id'])
+            edge = counts.setdefault(key, [0, 0])
+            edge[0 if row['in_groove'] else 1] += row['count']
+
+        edges.delete()
+        self.bulk_create([GrooveEdge(user_id=user_pk, from_asset_id=from_pk,
+                                     to_asset_id=to_pk, groove_up=up, groove_down=down)
+                          for (user_pk, from_pk, to_pk), (up, down) in counts.items()],
+                         batch_size=500)
+        return len(counts)
+
+class GrooveEdge(models.Model):
+    "How often one asset grooved, or didn't, after another for a user."
+    user            = models.ForeignKey(User)
+    from_asset      = models.ForeignKey(Asset, related_name='groove_edges_out')
+    to_asset        = models.ForeignKey(Asset, related_name='groove_edges_in')
+    groove_up       = models.PositiveIntegerField(default=0)
+    groove_down     = models.PositiveIntegerField(default=0)
+
+    objects = GrooveEdgeManager()
+
+    class Meta:
+        unique_together = (('user', 'from_asset', 'to_asset',),)
+
+    def __unicode__(self):
+        return u"{0} -> {1} for {2} (+{3}/-{4})".format(
+            self.from_asset_id, self.to_asset_id, self.user_id,
+            self.groove_up, self.groove_down)
+
+@receiver(post_save, sender=Play)
+@receiver(post_delete, sender=Play)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def _refresh_asset_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Asset.objects.refresh_stats([instance.asset_id],
+        plays=(sender is Play), ratings=(sender is Rating), files=False)
+    ShuffleCandidate.objects.refresh_track(instance.asset_id)
+
+@receiver(post_save, sender=AssetFile)
+@receiver(post_delete, sender=AssetFile)
+def _refresh_assetfile_count(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Asset.objects.refresh_stats([instance.asset_id], plays=False, ratings=False)
+        Track.objects.refresh_streamable([instance.asset_id])
+
+@receiver(post_save, sender=Track)
+def _sync_shuffle_candidate(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ShuffleCandidate.objects.sync_tracks([instance])
+
+@receiver(m2m_changed, sender=Asset.shared_with.through)
+def _sync_shuffle_candidate_sharing(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    pks = (pk_set or []) if reverse else [instance.pk]
+    ShuffleCandidate.objects.sync_tracks(Track._base_manager.filter(pk__in=pks))
+
+@receiver(post_save, sender=User)
+def _build_shuffle_candidates(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ShuffleCandidate.objects.rebuild_for_user(instance)
@@ -0,0 +1,101 @@
+"""
+Library re-scans for the rescan_assets management command.
+
+scan_file_task() fingerprints one stored file and, if it changed since
+it was last inspected, inspects it; it doesn't use the database, so it
+can run in a pool of worker processes.  save_scans() then writes a
+chunk of results back in a single transaction.
+"""
+from django.db import transaction
+
+from mediastream.assets.models import AssetDescriptor, AssetFile, InspectionResult, Track
+from mediastream.utilities.mediainspector import Inspector
+from mediastream.utilities.rangefile import open_ranged
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _as_int(value):
+    "Turns tag values like 3, '3' or '3/12' into 3."
+    try:
+        return int(unicode(value).split('/')[0])
+    except (TypeError, ValueError):
+        return None
+
+def scan_file_task(args):
+    """Checks one AssetFile's contents.
+
+    args is (pk, stored name, mimetype, (fingerprint, size) when last
+    inspected or None, force).  Returns (pk, (fingerprint, size),
+    InspectionResult field values or None if unchanged, error).
+    """
+    pk, name, mimetype, known, force = args
+    try:
+        assetfile = AssetFile(pk=pk, contents=name, mimetype=mimetype)
+        fingerprint = InspectionResult.objects.get_fingerprint(assetfile.contents)
+        if fingerprint == known and not force:
+            return pk, fingerprint, None, None
+        contents = open_ranged(assetfile.contents)
+        try:
+            inspobj = Inspector(contents, mimetype or None)
+        finally:
+            contents.close()
+        return pk, fingerprint, InspectionResult.objects.describe(inspobj), None
+    except Exception, e:
+        logger.exception(e)
+        return pk, None, None, u'{0}: {1}'.format(e.__class__.__name__, e)
+
+def save_scans(scans, asset_ids):
+    """Writes the changed files among scan_file_task() results.
+
+    asset_ids maps AssetFile pks to their Asset pks.  Updates the files'
+    length, MIME type and inspection, their primary AssetDescriptor, and
+    the tags of their Tracks.  Returns the number of files written.
+    """
+    changed = [(pk, fingerprint, fields) for pk, fingerprint, fields, error in scans
+               if fields is not None]
+    if not changed:
+        return 0
+
+    with transaction.atomic():
+        descriptors = []
+        for pk, (fingerprint, size), fields in changed:
+            result, created = InspectionResult.objects.get_or_create(
+                fingerprint=fingerprint, size=size, defaults=fields)
+            if not created:
+                InspectionResult.objects.filter(pk=result.pk).update(**fields)
+
+            updates = {'inspection': result}
+            if fields['length']:
+                updates['length'] = fields['length']
+            if fields['mimetype']:
+                updates['mimetype'] = fields['mimetype']
+            AssetFile.objects.filter(pk=pk).update(**updates)
+
+            tags = json.loads(fields['tags'])
+            track_updates = dict((field, value) for field, value in (
+                ('name', tags.get('name')),
+                ('year', _as_int(tags.get('year'))),
+                ('disc_number', _as_int(tags.get('disc'))),
+                ('track_number', _as_int(tags.get('track'))),
+                ('length', fields['length']),
+            ) if value)
+            if track_updates:
+                Track.objects.filter(pk=asset_ids[pk]).update(**track_updates)
+
+            descriptors.append(AssetDescriptor(
+                assetfile_id=pk,
+                bitstream=0,
+                mimetype=fields['mimetype'] or 'application/octet-stream',
+                bit_rate=fields['bit_rate'],
+                is_vbr=fields['is_vbr'],
+                lossy=fields['lossy'],
+                sample_rate=fields['sample_rate'],
+            ))
+
+        AssetDescriptor.objects.filter(assetfile__in=[pk for pk, f, s in changed],
+                                       bitstream=0).delete()
+        AssetDescriptor.objects.bulk_create(descriptors)
+    return len(changed)
@@ -0,0 +1,163 @@
+"""
+Vectorized shuffle scoring.
+
+A ShuffleScorer holds one user's shuffle candidates as compact NumPy arrays
+and turns them into weighted picks in a single pass, instead of popping
+Track instances off a list one at a time.  NumPy is optional; when it is
+missing, TrackManager.get_shuffle falls back to its original loop.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from datetime import datetime
+import gc
+
+EPOCH = datetime(1970, 1, 1)
+
+# Rating assumed for unrated tracks in 'rating' mode
+UNRATED_RATING = 2.5
+# How steeply 'rating' mode prefers well-rated tracks
+RATING_EXPONENT = 3
+# Weight multiplier per recorded groove in 'grooves' mode
+GROOVE_BOOST = 100
+# Most picks allowed from one album or artist in a batch
+MAX_PER_ALBUM = 4
+MAX_PER_ARTIST = 4
+
+def _seconds(dt):
+    return (dt - EPOCH).total_seconds()
+
+def _group_rank(values):
+    """Returns, for each element, how many equal values precede it.
+
+    values[i] is the group of the i-th pick; the result says how many
+    earlier picks came from the same group.
+    """
+    n = values.size
+    order = numpy.argsort(values, kind='mergesort')
+    ordered = values[order]
+    starts = numpy.ones(n, dtype=bool)
+    starts[1:] = ordered[1:] != ordered[:-1]
+    positions = numpy.arange(n)
+    group_start = numpy.maximum.accumulate(numpy.where(starts, positions, 0))
+    rank = numpy.empty(n, dtype=numpy.int64)
+    rank[order] = positions - group_start
+    return rank
+
+class ShuffleScorer(object):
+    """
+    Scores one user's shuffle candidates.
+
+    Each argument is a sequence with one entry per candidate track:
+    its pk, album and artist pks, rating bucket (None when unrated), and
+    when it becomes eligible to play again.  built is when the scorer is
+    made, by default now.
+    """
+    def __init__(self, track_ids, album_ids, artist_ids, ratings, eligible_after, built=None):
+        # Candidates already eligible when the scorer is built stay so,
+        # which spares converting most of the datetimes; weights() must
+        # then not be asked about a time before built.
+        built = built or datetime.now()
+        built_seconds = _seconds(built)
+        count = len(track_ids)
+        track_ids = numpy.fromiter(track_ids, dtype=numpy.int64, count=count)
+        order = numpy.argsort(track_ids)
+        self.track_ids = track_ids[order]
+        self.album_ids = numpy.fromiter(album_ids, dtype=numpy.int64, count=count)[order]
+        self.artist_ids = numpy.fromiter(artist_ids, dtype=numpy.int64, count=count)[order]
+        # None (unrated) becomes NaN, then 0
+        ratings = numpy.array(ratings, dtype=numpy.float32)
+        self.ratings = numpy.nan_to_num(ratings)[order]
+        eligible_after = numpy.fromiter((_seconds(dt) if dt > built else built_seconds
+                                         for dt in eligible_after),
+                                        dtype=numpy.float64, count=count)
+        self.eligible_after = eligible_after[order]
+
+    def __len__(self):
+        return self.track_ids.size
+
+    @classmethod
+    def from_rows(cls, rows, built=None):
+        "Builds a scorer from (track, album, artist, rating, eligible_after) rows."
+        # Unpacking a large pool makes millions of small tuples; pausing
+        # the cyclic collector meanwhile roughly halves the build time.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            rows = list(rows)
+            if not rows:
+                return cls([], [], [], [], [], built)
+            return cls(*(zip(*rows) + [built]))
+        finally:
+            if enabled:
+                gc.enable()
+
+    def positions(self, track_pks):
+        "Returns the array positions of the given track pks that are candidates."
+        track_pks = numpy.asarray(list(track_pks), dtype=numpy.int64)
+        if not track_pks.size or not self.track_ids.size:
+            return numpy.array([], dtype=numpy.int64)
+        found = numpy.searchsorted(self.track_ids, track_pks)
+        found = numpy.minimum(found, self.track_ids.size - 1)
+        return found[self.track_ids[found] == track_pks]
+
+    def weights(self, mode, now=None, grooves=None, antigrooves=(), exclude=()):
+        """Returns the relative chance of picking each candidate.
+
+        mode is one of 'shuffle', 'grooves' or 'rating', as chosen by
+        TrackManager.get_shuffle.  grooves maps track pks to how often
+        they grooved after the previous track.
+        """
+        now = _seconds(now or datetime.now())
+        weights = numpy.ones(self.track_ids.size, dtype=numpy.float64)
+        weights[self.eligible_after > now] = 0
+
+        if mode == 'rating':
+            rated = numpy.where(self.ratings > 0, self.ratings, UNRATED_RATING)
+            weights *= rated ** RATING_EXPONENT
+        elif mode == 'grooves' and grooves:
+            pks = list(grooves)
+            counts = numpy.array([grooves[pk] for pk in pks], dtype=numpy.float64)
+            found = numpy.searchsorted(self.track_ids, pks) if self.track_ids.size else []
+            for position, pk, count in zip(found, pks, counts):
+                if position < self.track_ids.size and self.track_ids[position] == pk:
+                    weights[position] *= 1 + GROOVE_BOOST * count
+
+        weights[self.positions(antigrooves)] = 0
+        weights[self.positions(exclude)] = 0
+        return weights
+
+    def draw(self, count, mode='shuffle', now=None, grooves=None,
+             antigrooves=(), exclude=(), replace=False, rng=None,
+             max_per_album=MAX_PER_ALBUM, max_per_artist=MAX_PER_ARTIST):
+        """Returns up to count track pks, best first.
+
+        Without replacement, picks follow weighted random keys, and no
+        album or artist appears more than the given limits.  With
+        replacement, picks are independent draws and may repeat.
+        """
+        rng = rng or numpy.random
+        weights = self.weights(mode, now, grooves, antigrooves, exclude)
+        live = numpy.flatnonzero(weights > 0)
+        if not live.size or count < 1:
+            return []
+
+        if replace:
+            chances = weights[live] / weights[live].sum()
+            picks = live[rng.choice(live.size, size=count, p=chances)]
+            return self.track_ids[picks].tolist()
+
+        # Weighted sampling without replacement: smallest key wins.
+        keys = rng.exponential(size=live.size) / weights[live]
+        considered = min(live.size, max(count * 20, 1000))
+        if considered < live.size:
+            best = numpy.argpartition(keys, considered - 1)[:considered]
+        else:
+            best = numpy.arange(live.size)
+        order = live[best[numpy.argsort(keys[best])]]
+
+        keep = ((_group_rank(self.album_ids[order]) < max_per_album) &
+                (_group_rank(self.artist_ids[order]) < max_per_artist))
+        return self.track_ids[order[keep][:count]].tolist()
@@ -0,0 +1,169 @@
+"""
+Serving AssetFile contents to players.
+
+ASSETS_STREAMING_BACKEND picks how players get the bytes:
+
+    None                  Hand out the storage's own URLs, such as signed
+                          S3 ones.  This is the default.
+    'x-accel-redirect'    nginx sends the file from an internal location,
+                          ASSETS_X_ACCEL_PREFIX, aliased to MEDIA_ROOT.
+    'x-sendfile'          Apache (mod_xsendfile) or lighttpd sends the file
+                          named in the X-Sendfile header.
+    'django'              Django sends the file itself, for deployments
+                          with neither S3 nor a front proxy.
+
+With X-Accel-Redirect or X-Sendfile the Django worker only checks
+permissions; the web server answers Range requests and copies the file
+with sendfile().  The 'django' backend answers Range and If-Range
+itself, streaming the requested bytes from a memory-mapped file
+ASSETS_STREAMING_CHUNK bytes at a time.  Files whose storage has no
+local path are redirected to.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.http import StreamingHttpResponse
+from django.utils.http import http_date, urlquote
+
+import mmap
+import os
+import re
+
+BACKENDS = ('x-accel-redirect', 'x-sendfile', 'django')
+
+# Highest bit rate (bits/s) to stream for each ?quality= hint
+QUALITY_BIT_RATES = getattr(settings, 'ASSETS_QUALITY_BIT_RATES', {
+    'low': 96000,
+    'medium': 160000,
+    'high': None,
+})
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def get_backend():
+    backend = getattr(settings, 'ASSETS_STREAMING_BACKEND', None)
+    if backend is not None and backend not in BACKENDS:
+        raise ImproperlyConfigured("ASSETS_STREAMING_BACKEND must be None or one of "
+                                   + ", ".join(BACKENDS))
+    return backend
+
+def get_stream_url(assetfile):
+    "Returns the URL a player should fetch assetfile's contents from."
+    if get_backend() is None:
+        return assetfile.contents.url
+    return reverse('stream-assetfile', args=(assetfile.pk,))
+
+def get_max_bit_rate(params):
+    """Returns the bit rate a client asked to stay within, or None.
+
+    params is request.GET or request.POST; clients send either bitrate,
+    in kb/s, or quality, one of QUALITY_BIT_RATES.
+    """
+    try:
+        return int(params['bitrate']) * 1000
+    except (KeyError, ValueError):
+        return QUALITY_BIT_RATES.get(params.get('quality'))
+
+def serve(request, assetfile):
+    "Returns a response that sends assetfile's contents the configured way."
+    backend = get_backend()
+    try:
+        path = assetfile.contents.path
+    except NotImplementedError:
+        path = None
+    if backend is None or path is None:
+        return HttpResponseRedirect(assetfile.contents.url)
+    if backend == 'django':
+        return serve_file(request, path, assetfile.mimetype)
+
+    response = HttpResponse(content_type=assetfile.mimetype or 'application/octet-stream')
+    if backend == 'x-accel-redirect':
+        prefix = getattr(settings, 'ASSETS_X_ACCEL_PREFIX', '/protected/')
+        response['X-Accel-Redirect'] = urlquote(
+            prefix.rstrip('/') + '/' + assetfile.contents.name.lstrip('/'))
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+def parse_range(header, size):
+    """Returns (first, last) byte positions for a Range header, or None.
+
+    None means the header should be ignored and the whole file sent;
+    multiple ranges, and ranges ending before they start, are treated
+    that way too.  Raises ValueError if the range starts past the end of
+    the file.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # The final n bytes
+        first, last = max(size - int(last), 0), size - 1
+    elif last and int(last) < int(first):
+        # Invalid rather than unsatisfiable, so the header is ignored
+        return None
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError(header)
+    return first, last
+
+def _iter_mapped(path, first, last, chunk_size):
+    "Yields bytes first to last of the file at path, mapping it only while reading."
+    fileobj = open(path, 'rb')
+    try:
+        mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(first, last + 1, chunk_size):
+                yield mapped[offset:min(offset + chunk_size, last + 1)]
+        finally:
+            mapped.close()
+    finally:
+        fileobj.close()
+
+def serve_file(request, path, content_type=None):
+    """Streams the local file at path, honoring Range and If-Range.
+
+    Answers 206 with the requested bytes, 416 for ranges past the end,
+    304 when If-None-Match matches, and 200 with the whole file
+    otherwise.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = '"{0:x}-{1:x}"'.format(int(stat.st_mtime), size)
+    last_modified = http_date(stat.st_mtime)
+
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        return HttpResponseNotModified()
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if size and (not if_range or if_range in (etag, last_modified)):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(size)
+            return response
+
+    if size:
+        first, last = byte_range or (0, size - 1)
+        chunk_size = getattr(settings, 'ASSETS_STREAMING_CHUNK', 64*1024)
+        response = StreamingHttpResponse(
+            _iter_mapped(path, first, last, chunk_size),
+            content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = str(last - first + 1)
+    else:
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = '0'
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(first, last, size)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# Measures how much of each MP3 Inspector reads, and how long it takes.
+#
+# Usage: python mediastream/assets/tools/bench_mp3.py [file or directory ...]
+#
+# Without arguments, inspects synthetic 5, 20 and 80 MB MP3s.  The
+# "read all" column is what finding the size with len(fp.read()) used
+# to cost on top of the inspection itself.
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mediastream.settings")
+
+from mediastream.utilities.mediainspector import Inspector
+
+from mutagen.id3 import ID3, TIT2, TPE1, TALB
+import shutil
+import tempfile
+import time
+
+# One frame of silence at 128 kb/s, 44.1 kHz
+FRAME = '\xff\xfb\x90\x64' + '\0' * 413
+
+class CountingFile(object):
+    "Passes calls through to a file, counting the bytes read."
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self.name = fileobj.name
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+def make_corpus(workdir):
+    for megabytes in (5, 20, 80):
+        path = os.path.join(workdir, '%i.mp3' % megabytes)
+        with open(path, 'wb') as f:
+            for i in xrange(megabytes * 1024 * 1024 / len(FRAME)):
+                f.write(FRAME)
+        tag = ID3()
+        tag.add(TIT2(encoding=3, text=u'Track %i' % megabytes))
+        tag.add(TPE1(encoding=3, text=u'Artist'))
+        tag.add(TALB(encoding=3, text=u'Album'))
+        tag.save(path)
+        yield path
+
+def corpus(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith('.mp3'):
+                        yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+def main(paths):
+    workdir = None
+    if not paths:
+        workdir = tempfile.mkdtemp()
+        paths = list(make_corpus(workdir))
+    try:
+        print "%-30s %12s %12s %10s %12s" % ('file', 'size', 'bytes read', 'ms', 'read all ms')
+        for path in corpus(paths):
+            f = CountingFile(open(path, 'rb'))
+            start = time.time()
+            Inspector(f, 'audio/mpeg')
+            inspect_ms = (time.time() - start) * 1000
+
+            f.seek(0)
+            start = time.time()
+            size = len(f._file.read())
+            read_all_ms = (time.time() - start) * 1000
+            f.close()
+            print "%-30s %12i %12i %10.2f %12.2f" % (
+                os.path.basename(path)[-30:], size, f.bytes_read, inspect_ms, read_all_ms)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# Compares the vectorized ShuffleScorer against the original shuffle loop.
+#
+# Usage: python mediastream/assets/tools/bench_shuffle.py [size size ...]
+#
+# Both sides work on synthetic in-memory candidates, so this measures the
+# Python/NumPy work only, not the database queries that feed it.
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mediastream.settings")
+
+from mediastream.assets.shuffle import ShuffleScorer
+
+from datetime import datetime, timedelta
+import random
+import time
+
+class Candidate(object):
+    def __init__(self, pk, album_id, artist_id, anno_rate, eligible_after):
+        self.pk = pk
+        self.album_id = album_id
+        self.artist_id = artist_id
+        self.anno_rate = anno_rate
+        self.eligible_after = eligible_after
+
+def make_candidates(size):
+    now = datetime.now()
+    out = []
+    for pk in xrange(1, size+1):
+        out.append(Candidate(
+            pk,
+            random.randint(1, max(1, size/12)),
+            random.randint(1, max(1, size/100)),
+            random.choice([None, None, 1, 2, 3, 4, 5]),
+            now + timedelta(days=random.randint(-60, 30)),
+        ))
+    return out
+
+def legacy_pick(candidates, offered, antigrooves):
+    "The old _get_shuffle_sample filter plus get_shuffle pop loop."
+    now = datetime.now()
+    pool = [c for c in candidates if c.eligible_after <= now]
+    random.shuffle(pool)        # stands in for ORDER BY RANDOM()
+    seen_albums = {}
+    seen_artists = {}
+    qssample = []
+    for t in pool:
+        seen_albums[t.album_id] = seen_albums.get(t.album_id, 0) + 1
+        seen_artists[t.artist_id] = seen_artists.get(t.artist_id, 0) + 1
+        if seen_albums[t.album_id] < 5 and seen_artists[t.artist_id] < 5:
+            qssample.append(t)
+        if len(qssample) > 199: break
+    qssample.sort(key=lambda k: k.anno_rate)
+    while qssample:
+        result = qssample.pop()
+        if result.pk in offered or result in antigrooves:
+            continue
+        return result.pk
+
+def timed(func, repeat):
+    start = time.time()
+    for i in range(repeat):
+        func()
+    return (time.time() - start) / repeat * 1000
+
+def main(sizes):
+    print "%10s %12s %12s %12s" % ('tracks', 'legacy ms', 'build ms', 'draw ms')
+    for size in sizes:
+        candidates = make_candidates(size)
+        offered = set(random.sample(xrange(1, size+1), min(size, 200)))
+        antigrooves = candidates[:10]
+        repeat = 5 if size <= 100000 else 2
+
+        legacy = timed(lambda: legacy_pick(candidates, offered, antigrooves), repeat)
+
+        rows = [(c.pk, c.album_id, c.artist_id, c.anno_rate, c.eligible_after)
+                for c in candidates]
+        start = time.time()
+        scorer = ShuffleScorer.from_rows(rows)
+        build = (time.time() - start) * 1000
+
+        draw = timed(lambda: scorer.draw(20, mode='rating', exclude=offered,
+                                         antigrooves=[c.pk for c in antigrooves]),
+                     repeat)
+        print "%10i %12.1f %12.1f %12.2f" % (size, legacy, build, draw)
+
+if __name__ == '__main__':
+    main([int(f) for f in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,101 @@
+"""
+Renditions for the transcode_assets management command.
+
+transcode_task() turns one stored file into another format with ffmpeg
+and stores the result without touching the database, so it can run in
+a pool of worker processes; save_renditions() then records the new
+files, which makes their tracks streamable.
+"""
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from mediastream.assets.models import AssetFile, InspectionResult, Rendition, TRANSCODE_PROFILES
+from mediastream.utilities.mediainspector import Inspector
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+class TranscodeError(Exception):
+    pass
+
+def transcode_task(args):
+    """Transcodes one stored file.
+
+    args is (Rendition pk, stored name of the source, profile).  Returns
+    (pk, stored name of the rendition, its size, InspectionResult field
+    values for it, error).
+    """
+    pk, name, profile = args
+    extension, mimetype, codec_args = TRANSCODE_PROFILES[profile]
+    storage = AssetFile._meta.get_field('contents').storage
+    workdir = tempfile.mkdtemp()
+    try:
+        try:
+            source = storage.path(name)
+        except NotImplementedError:
+            source = os.path.join(workdir, 'source' + os.path.splitext(name)[1])
+            with storage.open(name, 'rb') as src, open(source, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024*1024)
+
+        output = os.path.join(workdir, 'rendition' + extension)
+        process = subprocess.Popen(
+            [getattr(settings, 'ASSETS_FFMPEG', 'ffmpeg'), '-nostdin', '-loglevel', 'error',
+             '-i', source, '-vn', '-map_metadata', '0'] + codec_args + [output],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        if process.returncode:
+            raise TranscodeError(err.strip() or 'ffmpeg exited with status %i' % process.returncode)
+
+        with open(output, 'rb') as f:
+            fields = InspectionResult.objects.describe(Inspector(f, mimetype))
+            f.seek(0)
+            stored = storage.save(os.path.splitext(name)[0] + extension, File(f))
+        return pk, stored, os.path.getsize(output), fields, None
+    except Exception, e:
+        logger.exception(e)
+        return pk, None, 0, None, u'{0}: {1}'.format(e.__class__.__name__, e)
+    finally:
+        shutil.rmtree(workdir)
+
+def save_renditions(results):
+    """Records transcode_task() results as AssetFiles with descriptors.
+
+    Returns (renditions made, renditions failed).
+    """
+    made = failed = 0
+    renditions = Rendition.objects.select_related('source').in_bulk(
+                    [pk for pk, stored, size, fields, error in results])
+    for pk, stored, size, fields, error in results:
+        rendition = renditions[pk]
+        if error:
+            Rendition.objects.filter(pk=pk).update(state=Rendition.STATE_FAILED, last_error=error)
+            failed += 1
+            continue
+
+        extension, mimetype, codec_args = TRANSCODE_PROFILES[rendition.profile]
+        with transaction.atomic():
+            assetfile = AssetFile.objects.create(
+                name=rendition.source.name,
+                asset_id=rendition.source.asset_id,
+                contents=stored,
+                mimetype=fields['mimetype'] or mimetype,
+                length=fields['length'] or rendition.source.length,
+            )
+            assetfile.assetdescriptor_set.create(
+                bitstream=0,
+                mimetype=assetfile.mimetype,
+                bit_rate=fields['bit_rate'],
+                is_vbr=fields['is_vbr'],
+                lossy=True,
+                sample_rate=fields['sample_rate'],
+            )
+            Rendition.objects.filter(pk=pk).update(assetfile=assetfile, size=size,
+                                                   state=Rendition.STATE_DONE, last_error='')
+        made += 1
+    return made, failed
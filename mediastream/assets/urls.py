@@ -45,12 +45,15 @@ urlpatterns = patterns('',
             template_name="assets/track_list.html")),
     url(r'^track/(?P<pk>\d+)/$',
         login_required(DetailView.as_view(
-            model=Track,
+            queryset=Track.objects.select_related('streamable_file'),
             template_name="assets/track_play.html")),
         name='play-track'),
     url(r'^track/(?P<pk>\d+)/stream/$',
         TrackRedirector.as_view(),
         name='stream-track'),
+    url(r'^file/(?P<pk>\d+)/stream/$',
+        'mediastream.assets.views.stream_assetfile',
+        name='stream-assetfile'),
     url(r'^tracks/$',
         RedirectView.as_view(
             url='/assets/track/')),
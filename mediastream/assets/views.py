@@ -1,7 +1,7 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.core.files import File
 from django.core.urlresolvers import reverse
 from django.http import HttpRequest, HttpResponseRedirect, Http404
@@ -10,14 +10,12 @@ from django.template import RequestContext
 from django.views.decorators.cache import never_cache
 from django.views.generic import ListView, DetailView, RedirectView
 
+from mediastream.assets import streaming
 from mediastream.assets.forms import UploadFileForm, ImportFileForm
-from mediastream.assets.models import Album, Artist, Track, AssetFile, Play
-from mediastream.utilities.mediainspector import Inspector
+from mediastream.assets.models import Album, Artist, Track, AssetFile, Play, Rendition
 from mediastream.utilities.recursion import long_substr
 
 import os
-from tempfile import NamedTemporaryFile
-import zipfile
 
 @login_required
 @never_cache
@@ -28,99 +26,71 @@ def upload_file(request):
         imform = ImportFileForm(request.POST)
         stashes = []
         if upform.is_valid():
+            # Uploads are already seekable files; no need to copy them.
             for upload in request.FILES.getlist('file'):
-                stash = NamedTemporaryFile()
-                for chunk in upload.chunks():
-                    stash.write(chunk)
-                stash.seek(0)
-                stashes.append((stash, upload.name,))
+                stashes.append((upload, upload.name,))
 
         if imform.is_valid() and 'path' in request.POST:
-            stashes.append((open(request.POST.get('path')), request.POST.get('path'),))
+            stashes.append((open(request.POST.get('path'), 'rb'), request.POST.get('path'),))
 
         for stash, filename in stashes:
-            inspfp = NamedTemporaryFile(suffix=os.path.splitext(filename)[1])
-            inspfp.write(stash.read())
-            stash.seek(0)
-            inspfp.seek(0)
-            inspobj = Inspector(fileobj=inspfp)
-            files = []
-
-            if inspobj.mimetype == 'application/zip':
-                myzip = zipfile.ZipFile(stash)
-                count = 0
-                for member in myzip.namelist():
-                    # We could just use ZipFile.open, but we need to
-                    # be able to seek.
-                    if member.endswith('/'):
+            count = 0
+            try:
+                for i_count, (f, i) in enumerate(Track.objects.iter_import_files(stash)):
+                    count = i_count + 1
+                    mandatory = ['artist', 'album', 'name']
+                    proceed = True
+                    for attrib in mandatory:
+                        if not getattr(i, attrib, None):
+                            messages.error(request, 'Could not import sequence {0} - no {1} tag!'.format(i_count, attrib))
+                            proceed = False
+
+                    if not proceed:
                         continue
-                    mytarget = NamedTemporaryFile()
-                    mytarget.write(myzip.read(member))
-                    mytarget.seek(0)
-                    myinspfp = NamedTemporaryFile()
-                    myinspfp.write(mytarget.read())
-                    myinspobj = Inspector(fileobj=myinspfp)
-                    mytarget.seek(0)
-                    files.append((mytarget, myinspobj))
-                    count += 1
-                messages.info(request, 'Found {0} file{1} in zip file {2}.'.format(count, '' if count == 1 else 's', filename))
-            elif inspobj.mimetype.startswith('audio/'):
-                stash.seek(0)
-                files.append((stash, inspobj))
-                messages.info(request, 'Found {0} to be a Track of type {1}.'.format(filename, inspobj.mimetype))
+
+                    art, cre = Artist.bare.get_or_create(
+                        name__iexact=i.artist,
+                        defaults={
+                            'name': i.artist,
+                        },
+                    )
+                    if cre: messages.warning(request, 'Creating artist {0}'.format(art.name))
+                    alb, cre = Album.bare.get_or_create(
+                        name__iexact=i.album,
+                        defaults={
+                            'name': i.album,
+                            'is_compilation': getattr(i, 'is_compilation', False),
+                        },
+                    )
+                    if cre: messages.warning(request, 'Creating album {0}'.format(art.name))
+                    t, cre = Track.objects.get_or_create(
+                        name__iexact=i.name,
+                        album=alb,
+                        artist=art,
+                        defaults={
+                            'name': i.name,
+                            'track_number': getattr(i, 'track', None),
+                            'disc_number': getattr(i, 'disc', None),
+                            'length': getattr(i, 'length', None),
+                        },
+                    )
+
+                    af = AssetFile.objects.create(
+                        name=i.name,
+                        asset=t,
+                        contents=File(f),
+                        mimetype=i.mimetype,
+                    )
+
+                    t._inspect_files(qs=t.assetfile_set.filter(pk=af.pk), inspected={af.pk: i})
+
+                    messages.success(request, 'Imported {0} by {1}.'.format(t.name, art.name))
+            except ValueError, e:
+                messages.error(request, unicode(e))
             else:
-                messages.error(request, 'Could not figure out what to do with {0} of type {1}.'.format(filename, inspobj.mimetype))
-
-            for f, i in files:
-                count = 0
-                mandatory = ['artist', 'album', 'name']
-                proceed = True
-                for attrib in mandatory:
-                    if not getattr(i, attrib, None):
-                        messages.error(request, 'Could not import sequence {0} - no {1} tag!'.format(count, attrib))
-                        proceed = False
-
-                if not proceed:
-                    continue
-
-                art, cre = Artist.objects.get_or_create(
-                    name__iexact=i.artist,
-                    defaults={
-                        'name': i.artist,
-                    },
-                )
-                if cre: messages.warning(request, 'Creating artist {0}'.format(art.name))
-                alb, cre = Album.objects.get_or_create(
-                    name__iexact=i.album,
-                    defaults={
-                        'name': i.album,
-                        'is_compilation': getattr(i, 'is_compilation', False),
-                    },
-                )
-                if cre: messages.warning(request, 'Creating album {0}'.format(art.name))
-                t, cre = Track.objects.get_or_create(
-                    name__iexact=i.name,
-                    album=alb,
-                    artist=art,
-                    defaults={
-                        'name': i.name,
-                        'track_number': getattr(i, 'track', None),
-                        'disc_number': getattr(i, 'disc', None),
-                        'length': getattr(i, 'length', None),
-                    },
-                )
-
-                af = AssetFile.objects.create(
-                    name=i.name,
-                    asset=t,
-                    contents=File(f),
-                    mimetype=i.mimetype,
-                )
-
-                t._inspect_files(qs=t.assetfile_set.filter(pk=af.pk))
-
-                messages.success(request, 'Imported {0} by {1}.'.format(t.name, art.name))
-                count += 1
+                messages.info(request, 'Found {0} file{1} in {2}.'.format(count, '' if count == 1 else 's', filename))
+            finally:
+                stash.close()
             return HttpResponseRedirect('/assets/upload/')
     else:
         upform = UploadFileForm()
@@ -238,10 +208,12 @@ class TrackRedirector(RedirectView):
     permanent = False
 
     def get_redirect_url(self, **kwargs):
-        track = get_object_or_404(Track, pk=kwargs['pk'])
+        track = get_object_or_404(Track.objects.select_related('streamable_file'), pk=kwargs['pk'])
         try:
-            url = track.get_streaming_url()
+            url = track.get_streaming_url(streaming.get_max_bit_rate(self.request.GET))
         except ObjectDoesNotExist:
+            # Have transcode_assets make something playable
+            Rendition.objects.request([track])
             return None
 
         play_pointer = Play.objects.create(
@@ -251,6 +223,15 @@ class TrackRedirector(RedirectView):
 
         return url
 
+@login_required
+@never_cache
+def stream_assetfile(request, pk):
+    "Has the web server send an AssetFile's contents; see ASSETS_STREAMING_BACKEND."
+    assetfile = get_object_or_404(AssetFile.objects.select_related('asset'), pk=pk)
+    if not assetfile.asset.user_can_stream(request.user):
+        raise PermissionDenied
+    return streaming.serve(request, assetfile)
+
 class M3UDetailView(DetailView):
     def render_to_response(self, context, **response_kwargs):
         """
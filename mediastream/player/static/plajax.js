@@ -127,6 +127,9 @@ var bug_server = function(data){
             data.user           = user_id;
             data.playlistLength = $(jplaylist.playlist).length;
             data.caboosePk      = $(jplaylist.playlist).last()[0].pk;
+            if(stream_quality) {
+                data.quality    = stream_quality;
+            }
             return data;
         }(data),
         dataType: "json",
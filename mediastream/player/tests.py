@@ -5,8 +5,18 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
 
+from mediastream.assets.models import Album, Artist, AssetFile, Play, Track
+from mediastream.queuer.models import AssetQueue, AssetQueueItem
+from mediastream.utilities import instrumentation
+from mediastream.utilities.testing import QueryBudgetMixin, local_site
+
+import json
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +24,73 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+@local_site
+class PlayerQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('dj', 'dj@example.com', 'secret')
+        self.client.login(username='dj', password='secret')
+        artist = Artist.objects.create(name='Wings')
+        album = Album.objects.create(name='Band on the Run')
+        self.queue = AssetQueue.objects.create(user=self.user)
+        for number in range(1, 9):
+            track = Track.objects.create(name='Track %i' % number, track_number=number,
+                                         artist=artist, album=album, owner=self.user)
+            AssetFile.objects.create(asset=track, name=track.name,
+                                     contents='track%i.mp3' % number, mimetype='audio/mpeg')
+            AssetQueueItem.objects.create(queue=self.queue, asset_object=track)
+
+    def post(self, view, **data):
+        return self.client.post(reverse(view), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_music_player(self):
+        self.assertQueryBudget(10, self.client.get, reverse('player_ui'))
+
+    def test_event_handler_offers_tracks(self):
+        self.client.get(reverse('player_ui'))
+        response = self.assertQueryBudget(20, self.post, 'player_event', playlistLength=0)
+        d = json.loads(response.content)
+        self.assertEqual(len(d['tracks']), 4)
+        self.assertTrue(d['_queries'] > 0)
+
+        item = AssetQueueItem.objects.get(pk=d['tracks'][0]['pk'])
+        self.assertQueryBudget(28, self.post, 'player_event', playlistLength=3,
+                               mediaPk=item.pk, eventType='jPlayer_play')
+
+    def test_collect_rating(self):
+        self.client.get(reverse('player_ui'))
+        item = self.queue.item_set.all()[0]
+        self.post('player_event', mediaPk=item.pk, eventType='jPlayer_play',
+                  playlistLength=4)
+        response = self.assertQueryBudget(22, self.post, 'player_rating',
+                                          assetpk=item.object_id, rating=4, groove='awyeah')
+        self.assertEqual(json.loads(response.content)['rating'], 4)
+
+    def test_event_handler_picks_bit_rates_per_batch(self):
+        for assetfile in AssetFile.objects.all():
+            assetfile.assetdescriptor_set.create(bitstream=0, mimetype='audio/mpeg', bit_rate=128000)
+        self.client.get(reverse('player_ui'))
+        response = self.assertQueryBudget(20, self.post, 'player_event', playlistLength=0, bitrate=96)
+        d = json.loads(response.content)
+        self.assertEqual(len(d['tracks']), 4)
+
+    def test_request_stats(self):
+        instrumentation.reset_totals()
+        self.client.get(reverse('player_ui'))
+        stats = json.loads(self.client.get(reverse('request-stats')).content)
+        totals = stats['views']['mediastream.player.views.music_player']
+        self.assertEqual(totals['requests'], 1)
+        self.assertTrue(totals['queries'] > 0)
+
+    def test_request_stats_without_debug_cursor(self):
+        instrumentation.reset_totals()
+        queries = len(connection.queries)
+        self.client.get(reverse('player_ui'))
+        self.client.get('/no/such/page/1/')
+        self.client.get('/no/such/page/2/')
+        self.assertEqual(len(connection.queries), queries)
+        totals = instrumentation.get_totals()
+        self.assertTrue(totals['mediastream.player.views.music_player']['queries'] > 0)
+        self.assertEqual(totals[instrumentation.UNRESOLVED]['requests'], 2)
+        self.assertFalse([name for name in totals if name.startswith('/')])
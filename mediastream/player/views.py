@@ -1,15 +1,16 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.humanize.templatetags.humanize import naturalday
-from django.db import connection
 from django.db.models import Count
 from django.views.decorators.cache import never_cache, cache_page
 from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404, render_to_response, redirect
 from django.template import RequestContext
 
-from mediastream.assets.models import Asset, AssetFile, Play, Rating, Track, Artist, Album, Discogs
+from mediastream.assets.models import Asset, AssetFile, Play, Rating, Track, Artist, Album, Discogs, DiscogsQueueItem, GrooveEdge, Rendition
+from mediastream.assets.streaming import get_max_bit_rate
 from mediastream.queuer.models import AssetQueue, AssetQueueItem
+from mediastream.utilities import instrumentation
 
 from datetime import datetime, timedelta
 import discogs_client as discogs
@@ -55,7 +56,9 @@ def music_player(request):
     request.session['offer_pointer'] = None
     request.session['play_pointer'] = None
 
-    return render_to_response('player/queue_play.html', {}, context_instance=RequestContext(request))
+    return render_to_response('player/queue_play.html', {
+        'stream_quality': request.GET.get('quality', ''),
+    }, context_instance=RequestContext(request))
 
 @login_required
 def player_event_handler(request):
@@ -87,6 +90,9 @@ def player_event_handler(request):
     # Last track on the far side
     caboose_pk = int(post.get('caboosePk', 0))
 
+    # Bandwidth the client asked us to stay within
+    max_bit_rate = get_max_bit_rate(post)
+
     # Start building response
     if not queue_pk:
         d['response'] = ("I'm sorry, but please reload this page when "
@@ -100,16 +106,19 @@ def player_event_handler(request):
     if current_track_pk:
         current_track = AssetQueueItem.objects.get(pk=current_track_pk)
 
-        current_name = current_track.asset.track.name
-        current_artist = current_track.asset.track.artist
+        # Queue items always point at Tracks, which carry their own play
+        # statistics, so there's no need to reload the Asset.
+        ct_asset = current_track.asset
+        current_name = ct_asset.name
+        current_artist = ct_asset.artist
 
         d = {
-             'artistName':  current_track.asset.track.artist.name,
-             'artistPk':    current_track.asset.track.artist.pk,
-             'trackName':   current_track.asset.track.name,
-             'trackPk':     current_track.asset.track.pk,
-             'albumName':   current_track.asset.track.album.name,
-             'albumPk':     current_track.asset.track.album.pk,
+             'artistName':  current_artist.name,
+             'artistPk':    current_artist.pk,
+             'trackName':   ct_asset.name,
+             'trackPk':     ct_asset.pk,
+             'albumName':   ct_asset.album.name,
+             'albumPk':     ct_asset.album_id,
              'queuePk':     queue.pk,
             }
 
@@ -138,8 +147,6 @@ def player_event_handler(request):
             current_track.state = 'playing'
             current_track.save()
 
-            ct_asset = Asset.objects.get(pk=current_track.asset.pk)
-
             last_play = ct_asset.last_play
 
             if last_play:
@@ -195,89 +202,95 @@ def player_event_handler(request):
 
     # Top off the user's playlist when we get a chance
     d['tracks'] = []
-    while ((len(d['tracks']) + remaining) < TRACKS_OUT):
-        try:
-            if queue.item_set.filter(state='offered').count() >= TRACKS_OUT:
-                # already have plenty of tracks out
-                break
-
-            if offer_pointer is not None and caboose_pk > 0 and caboose_pk < offer_pointer.pk:
-                # we're handling an old message, skip it
+    wanted = TRACKS_OUT - remaining
+    if offer_pointer is not None and caboose_pk > 0 and caboose_pk < offer_pointer.pk:
+        # we're handling an old message, skip it
+        wanted = 0
+    elif wanted > 0:
+        # don't exceed the tracks we already have out
+        wanted = min(wanted, TRACKS_OUT - queue.item_set.filter(state='offered').count())
+
+    passes = 0
+    while len(d['tracks']) < wanted and passes < TRACKS_OUT:
+        passes += 1
+        batch = queue.get_waiting_items(wanted - len(d['tracks']), after=offer_pointer)
+
+        if not batch:
+            # queue is empty!
+            # perform housekeeping
+            d['_expired'] = queue.do_expire_old_items()
+            if not queue.randomize:
                 break
-
-            if offer_pointer is not None and queue.item_set.exists():
-                next_track = offer_pointer.get_next_by_created()
-            elif offer_pointer is None and queue.item_set.exists():
-                # initialize it to the first valid item in the queue
-                next_track = queue.item_set.all()[0]
-            else:
-                # is it... empty?!
-                raise AssetQueueItem.DoesNotExist
+            # add more tracks, if required
+            previous = offer_pointer.object_id if offer_pointer else None
+            for i in range(wanted - len(d['tracks'])):
+                randtrack = Track.objects.get_shuffle(request.user, previous)
+                previous = randtrack.pk
+                if not AssetQueueItem.objects.filter(
+                    object_id=randtrack.pk,
+                    state__in=['offered', 'playing'],
+                ).exists():
+                    aqi = AssetQueueItem.objects.create(
+                        asset_object = randtrack,
+                        queue = queue,
+                    )
+                    d['randstats'] = randtrack._randstats
+            continue
+
+        offered = []
+        errored = []
+        untranscoded = []
+        lookups = []
+        if max_bit_rate is not None:
+            # One query for the whole batch, rather than one per track
+            Track.objects.pick_streams([item.asset for item in batch], max_bit_rate)
+        for next_track in batch:
             offer_pointer = next_track
-            if next_track.state != 'waiting':
-                continue
             if not request.user.has_perm('asset.can_stream_asset', next_track.asset):
                 continue
 
-            nt_asset = Asset.objects.get(pk=next_track.asset.pk)
+            nt_track = next_track.asset
 
             # Try to build out discogs data slowly but surely
+            for thing in [nt_track.artist, nt_track.album]:
+                if thing.discogs_id is None:
+                    lookups.append(thing)
+
             try:
-                artist = nt_asset.track.artist
-                #album  = next_track.asset.track.album
-                artist.discogs = Discogs.objects.get_for_object(artist)
-                artist.save()
-                #album.discogs = Discogs.objects.get_for_object(album)
-                #album.save()
-            except Discogs.DoesNotExist:
-                pass
-
-            key = nt_asset.track.get_streaming_exten()
-            url = nt_asset.track.get_streaming_url()
+                key = nt_track.get_streaming_exten(max_bit_rate)
+                url = nt_track.get_streaming_url(max_bit_rate)
+            except AssetFile.DoesNotExist:
+                # no way to stream this yet!
+                errored.append(next_track.pk)
+                untranscoded.append(nt_track)
+                continue
             try:
-                poster = nt_asset.track.get_artwork_url()
+                poster = nt_track.get_artwork_url()
             except Exception, e:
                 logger.exception(e)
                 poster = None
-            last_play = nt_asset.last_play
+            last_play = nt_track.last_play
             d['tracks'].append({
                 key: url,
                 'pk': next_track.pk,
-                'assetPk': nt_asset.pk,
-                'album': nt_asset.track.album.name,
-                'artist': nt_asset.track.artist.name,
-                'title': nt_asset.track.name,
+                'assetPk': nt_track.pk,
+                'album': nt_track.album.name,
+                'artist': nt_track.artist.name,
+                'title': nt_track.name,
                 'free': request.user.has_perm('asset.can_download_asset', next_track.asset),
                 'poster': poster or '',
-                'averageRating': nt_asset.average_rating or 0,
+                'averageRating': nt_track.average_rating or 0,
                 'lastPlayAt': last_play.isoformat() if last_play else '',
             })
-            next_track.state = 'offered'
-            next_track.save()
+            offered.append(next_track.pk)
 
-        except AssetFile.DoesNotExist:
-            # no way to stream this!
-            next_track.state = 'fileerror'
-            next_track.save()
-
-        except AssetQueueItem.DoesNotExist:
-            # queue is empty!
-            # perform housekeeping
-            d['_expired'] = queue.do_expire_old_items()
-            # add more tracks, if required
-            if queue.randomize:
-                randtrack = Track.objects.get_shuffle(request.user, offer_pointer)
-                if not AssetQueueItem.objects.filter(
-                    object_id=randtrack.pk,
-                    state__in=['offered', 'playing'],
-                ).exists():
-                    aqi = AssetQueueItem.objects.create(
-                        asset_object = randtrack,
-                        queue = queue,
-                    )
-                    d['randstats'] = randtrack._randstats
-            else:
-                break
+        if offered:
+            AssetQueueItem.objects.filter(pk__in=offered).update(state='offered')
+        if errored:
+            AssetQueueItem.objects.filter(pk__in=errored).update(state='fileerror')
+            Rendition.objects.request(untranscoded)
+        if lookups:
+            DiscogsQueueItem.objects.enqueue(lookups)
 
     if request.session.get('first_refresh', False):
         request.session['first_refresh'] = False
@@ -285,19 +298,20 @@ def player_event_handler(request):
             request.user.first_name or request.user.username,
             unicode(queue),
             Track.objects.count(),
-            Album.objects.count(),
-            Artist.objects.count(),
+            Album.bare.count(),
+            Artist.bare.count(),
             Play.objects.count(),
             Rating.objects.count(),
         )
 
     # God save the state
     request.session['active_queue'] = queue.pk
-    request.session['offer_pointer'] = offer_pointer.pk
+    request.session['offer_pointer'] = offer_pointer.pk if offer_pointer else None
     request.session['play_pointer'] = play_pointer_pk
 
-    d['_queries'] = len(connection.queries)
-    d['_querytime'] = int(sum([float(f.get('time', 0)) for f in connection.queries])*1000)
+    stats = instrumentation.current_stats()
+    d['_queries'] = stats.get('queries')
+    d['_querytime'] = stats.get('db_ms')
     d['_revision'] = gitrevision()[0:10]
 
     return HttpResponse(json.dumps(d), mimetype="application/json")
@@ -384,13 +398,15 @@ def collect_rating(request):
 
         asset = Asset.objects.get(pk=asset.pk)  # reload so that average_rating is right
         d['avg_rating'] = asset.average_rating or 0
-        d['total_ratings'] = asset.rating_set.count()
+        d['total_ratings'] = asset.rating_count
 
     # Handle groove, which is related to how well this track fits
     # into a stream of plays.
     if groove and play:
+        was_in_groove = play.in_groove
         play.in_groove = GROOVE_STATES.get(groove, None)
         play.save()
+        GrooveEdge.objects.record(play, was_in_groove)
 
         if play.in_groove is True:
             resp.append("Acknowledging ongoing groove.")
@@ -401,8 +417,9 @@ def collect_rating(request):
 
     d['response'] = ' '.join(resp)
 
-    d['_queries'] = len(connection.queries)
-    d['_querytime'] = int(sum([float(f.get('time', 0)) for f in connection.queries])*1000)
+    stats = instrumentation.current_stats()
+    d['_queries'] = stats.get('queries')
+    d['_querytime'] = stats.get('db_ms')
     d['_revision'] = gitrevision()[0:10]
 
     return HttpResponse(json.dumps(d), mimetype="application/json")
@@ -436,7 +453,8 @@ def discogs_image_view(request, image):
     c.setopt(pycurl.FOLLOWLOCATION, 1)
     c.setopt(pycurl.HEADERFUNCTION, h.write)
     c.setopt(pycurl.WRITEFUNCTION, b.write)
-    c.perform()
+    with instrumentation.timed_http():
+        c.perform()
     b.seek(0)
     h.seek(0)
 
@@ -4,6 +4,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.core.cache import cache
 from mediastream.assets.models import Asset, Album, Track
+from mediastream.utilities.s3media import prefetch_urls
 
 from datetime import datetime, timedelta
 
@@ -41,6 +42,37 @@ class AssetQueue(models.Model):
                  )
             return qs.delete()
 
+    def get_waiting_items(self, count, after=None):
+        """Returns up to count waiting items, in queue order.
+
+        Items are fetched in one query, starting after the given item if
+        provided, and their tracks are attached with artists, albums,
+        Discogs records, streamable files and artwork already loaded, and
+        the files' URLs looked up together.
+        """
+        qs = self.item_set.filter(state='waiting')
+        if after is not None:
+            qs = qs.filter(pk__gt=after.pk)
+        items = list(qs.order_by('pk')[:count])
+        if not items:
+            return items
+
+        tracks = Track.objects.filter(
+                    pk__in=[item.object_id for item in items],
+                 ).select_related(
+                    'artist', 'album', 'artist__discogs', 'album__discogs',
+                    'primary_artwork', 'streamable_file',
+                 )
+        tracks = dict((track.pk, track) for track in tracks)
+        prefetch_urls(track.streamable_file.contents for track in tracks.values()
+                      if track.streamable_file_id)
+
+        for item in items:
+            if item.object_id in tracks:
+                setattr(item, AssetQueueItem.asset_object.cache_attr,
+                        tracks[item.object_id])
+        return items
+
 class AssetQueueItem(models.Model):
     STATE_CHOICES = (
                      ('waiting', 'Waiting in queue'),
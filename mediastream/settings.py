@@ -93,6 +93,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'mediastream.utilities.instrumentation.InstrumentationMiddleware',
     'django.middleware.cache.UpdateCacheMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -167,13 +168,14 @@ USE_X_FORWARDED_HOST=True
 # File storage
 # See AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_STORAGE_BUCKET_NAME
 # in local_settings.py
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto.S3BotoStorage'
+DEFAULT_FILE_STORAGE = 'mediastream.utilities.s3media.S3MediaStorage'
 ASSETS_UPLOAD_TO = '/'
 AWS_DEFAULT_ACL = 'private'
 AWS_AUTO_CREATE_BUCKET=True
 AWS_REDUCED_REDUNDANCY=False
 AWS_S3_SECURE_URLS=False
 AWS_QUERYSTRING_EXPIRE=86400
+AWS_QUERYSTRING_CACHE_MARGIN=3600  # signed URLs are reused until this close to expiry
 AWS_HEADERS = {
     'Cache-Control': 'private, max-age=604800',
 }
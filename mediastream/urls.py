@@ -11,6 +11,7 @@ urlpatterns = patterns('',
 
     url(r'^assets/', include('mediastream.assets.urls')),
     url(r'^player/', include('mediastream.player.urls')),
+    url(r'^stats/requests/$', 'mediastream.utilities.instrumentation.request_stats_view', name='request-stats'),
     (r'^accounts/login/$', 'django.contrib.auth.views.login', {'template_name': 'login.html'}),
 
     # Uncomment the admin/doc line below to enable admin documentation:
@@ -0,0 +1,238 @@
+"""
+Per-request counters for database queries, cache lookups and outbound
+HTTP calls.
+
+Install InstrumentationMiddleware to measure every view, or wrap single
+views with @instrumented.  Each finished request logs one line to the
+mediastream.utilities.instrumentation logger and adds to per-view totals
+that staff can read from request_stats_view.  Unlike connection.queries,
+this works with DEBUG off, and without keeping every query's SQL.
+"""
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.db.backends import BaseDatabaseWrapper
+from django.http import HttpResponse
+
+from contextlib import contextmanager
+from functools import wraps
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Requests making more queries than this are logged as warnings
+QUERY_WARNING = getattr(settings, 'INSTRUMENTATION_QUERY_WARNING', 100)
+
+# Totals for requests that didn't resolve to a view, such as 404s, go here
+UNRESOLVED = '<unresolved>'
+
+_local = threading.local()
+_totals = {}
+_totals_lock = threading.Lock()
+
+class Probe(object):
+    "Counts what one request or view does while it is active."
+    def __init__(self, name=None):
+        self.name = name
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.http_calls = 0
+        self.http_time = 0.0
+
+    def start(self):
+        self.started = time.time()
+        _local.probe = self
+        return self
+
+    def stop(self):
+        stats = self.get_stats()
+        _local.probe = None
+        return stats
+
+    def get_stats(self):
+        "Returns the counters so far, with times in milliseconds."
+        return {
+            'queries':      self.queries,
+            'db_ms':        int(self.query_time * 1000),
+            'cache_hits':   self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'http_calls':   self.http_calls,
+            'http_ms':      int(self.http_time * 1000),
+            'total_ms':     int((time.time() - self.started) * 1000),
+        }
+
+def get_probe():
+    "Returns the active Probe for this thread, if any."
+    return getattr(_local, 'probe', None)
+
+def current_stats():
+    "Returns the active Probe's counters so far, or {} if nothing is measuring."
+    probe = get_probe()
+    return probe.get_stats() if probe else {}
+
+@contextmanager
+def timed_http():
+    "Counts the time spent in the block as outbound HTTP."
+    start = time.time()
+    try:
+        yield
+    finally:
+        probe = get_probe()
+        if probe:
+            probe.http_calls += 1
+            probe.http_time += time.time() - start
+
+class CountingCursor(object):
+    "Wraps a database cursor to count and time its queries for the active probe."
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def _counted(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            probe = get_probe()
+            if probe:
+                probe.queries += 1
+                probe.query_time += time.time() - start
+
+    def execute(self, sql, params=None):
+        return self._counted(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._counted(self.cursor.executemany, sql, param_list)
+
+def _install_query_counters():
+    "Wraps the cursors of every database connection so that probes can count queries."
+    if getattr(BaseDatabaseWrapper, '_instrumented', False):
+        return
+    cursor = BaseDatabaseWrapper.cursor
+
+    def counted_cursor(self):
+        return CountingCursor(cursor(self))
+
+    BaseDatabaseWrapper.cursor = counted_cursor
+    BaseDatabaseWrapper._instrumented = True
+
+def _install_cache_counters():
+    "Wraps the default cache's lookups so that probes can count hits and misses."
+    if getattr(cache, '_instrumented', False):
+        return
+    get, get_many = cache.get, cache.get_many
+
+    def counted_get(key, default=None, version=None):
+        value = get(key, default=default, version=version)
+        probe = get_probe()
+        if probe:
+            if value is default:
+                probe.cache_misses += 1
+            else:
+                probe.cache_hits += 1
+        return value
+
+    def counted_get_many(keys, version=None):
+        keys = list(keys)
+        values = get_many(keys, version=version)
+        probe = get_probe()
+        if probe:
+            probe.cache_hits += len(values)
+            probe.cache_misses += len(keys) - len(values)
+        return values
+
+    cache.get = counted_get
+    cache.get_many = counted_get_many
+    cache._instrumented = True
+
+def _record(name, stats, status=None):
+    with _totals_lock:
+        totals = _totals.setdefault(name, {'requests': 0, 'max_queries': 0})
+        totals['requests'] += 1
+        totals['max_queries'] = max(totals['max_queries'], stats['queries'])
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+
+    level = logging.WARNING if stats['queries'] > QUERY_WARNING else logging.INFO
+    logger.log(level, u"%s status=%s queries=%i db=%ims cache=%i/%i http=%i/%ims total=%ims",
+               name, status, stats['queries'], stats['db_ms'],
+               stats['cache_hits'], stats['cache_misses'],
+               stats['http_calls'], stats['http_ms'], stats['total_ms'])
+
+def get_totals():
+    "Returns {view name: counters} summed over this process's requests."
+    with _totals_lock:
+        return dict((name, dict(totals)) for name, totals in _totals.items())
+
+def reset_totals():
+    with _totals_lock:
+        _totals.clear()
+
+def _view_name(view_func):
+    view_func = getattr(view_func, 'view_func', view_func)
+    return '%s.%s' % (getattr(view_func, '__module__', '?'),
+                      getattr(view_func, '__name__', view_func.__class__.__name__))
+
+def instrumented(view_func):
+    "Measures a single view.  Does nothing extra under the middleware."
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if get_probe():
+            return view_func(request, *args, **kwargs)
+        _install_query_counters()
+        _install_cache_counters()
+        probe = Probe(_view_name(view_func)).start()
+        response = None
+        try:
+            response = view_func(request, *args, **kwargs)
+            return response
+        finally:
+            _record(probe.name, probe.stop(), getattr(response, 'status_code', None))
+    return wrapper
+
+class InstrumentationMiddleware(object):
+    """
+    Measures every request.  Put it first in MIDDLEWARE_CLASSES so that it
+    also sees the work done by the other middleware.
+    """
+    def __init__(self):
+        _install_query_counters()
+        _install_cache_counters()
+
+    def process_request(self, request):
+        request._instrumentation_probe = Probe(UNRESOLVED).start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        probe = getattr(request, '_instrumentation_probe', None)
+        if probe:
+            probe.name = _view_name(view_func)
+
+    def process_response(self, request, response):
+        probe = getattr(request, '_instrumentation_probe', None)
+        if probe and get_probe() is probe:
+            _record(probe.name, probe.stop(), response.status_code)
+        return response
+
+@staff_member_required
+def request_stats_view(request):
+    "Shows this process's per-view totals and averages as JSON."
+    views = {}
+    for name, totals in get_totals().items():
+        averages = dict(('avg_' + key, float(totals[key]) / totals['requests'])
+                        for key in ('queries', 'db_ms', 'cache_hits', 'cache_misses',
+                                    'http_ms', 'total_ms'))
+        averages.update(totals)
+        views[name] = averages
+    return HttpResponse(json.dumps({'pid': os.getpid(), 'views': views}, sort_keys=True),
+                        content_type="application/json")
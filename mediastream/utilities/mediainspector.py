@@ -11,9 +11,11 @@ from mutagen.flac import FLAC, FLACNoHeaderError
 from mutagen.ogg import error as OggError
 from mutagen.ogg import OggPage
 from mutagen.oggvorbis import OggVorbis, OggVorbisInfo, OggVCommentDict, OggVorbisHeaderError
+from mutagen.oggopus import OggOpus
 
 import magic
 import mimetypes
+import sys
 
 # Add previously-unknown mimetypes
 mt = mimetypes.MimeTypes()
@@ -32,20 +34,117 @@ for mtkey, mtvalue in mtmap.items():
 
 MIMETYPE_CHOICES = sorted(mimetypes_grouped.items())
 
+# How much of a file the magic number checks, then libmagic, get to look at
+HEADER_BYTES = 4*1024
+SNIFF_BYTES = 256*1024
+
+# MP4 brands for audio-only files
+AUDIO_MP4_BRANDS = ('M4A ', 'M4B ', 'M4P ', 'F4A ', 'F4B ')
+
+def _is_mpeg_frame(header):
+    "Returns True if header starts with a plausible MPEG audio frame header."
+    if len(header) < 4:
+        return False
+    b0, b1, b2 = ord(header[0]), ord(header[1]), ord(header[2])
+    return (b0 == 0xFF and b1 & 0xE0 == 0xE0
+            and (b1 >> 3) & 3 != 1      # reserved version
+            and (b1 >> 1) & 3 != 0      # reserved layer (or ADTS AAC)
+            and b2 >> 4 != 0xF          # bad bitrate
+            and (b2 >> 2) & 3 != 3)     # reserved sample rate
+
+def _match_header(header, fileobj):
+    "Recognizes the formats we import from their magic numbers."
+    if header.startswith('ID3') and len(header) >= 10:
+        # Look past the tag: FLAC files occasionally carry one, too
+        size = 0
+        for byte in header[6:10]:
+            size = size * 128 + (ord(byte) & 0x7F)
+        size += 20 if ord(header[5]) & 0x10 else 10
+        fileobj.seek(size)
+        after = fileobj.read(4)
+        return 'audio/x-flac' if after == 'fLaC' else 'audio/mpeg'
+    elif header.startswith('fLaC'):
+        return 'audio/x-flac'
+    elif header.startswith('OggS'):
+        if '\x01vorbis' in header or 'OpusHead' in header or '\x7fFLAC' in header:
+            return 'audio/ogg'
+        return 'application/ogg'
+    elif header[4:8] == 'ftyp':
+        return 'audio/mp4' if header[8:12] in AUDIO_MP4_BRANDS else 'video/mp4'
+    elif header[:4] in ('PK\x03\x04', 'PK\x05\x06'):
+        return 'application/zip'
+    elif header.startswith('RIFF') and header[8:12] == 'WAVE':
+        return 'audio/x-wav'
+    elif _is_mpeg_frame(header):
+        return 'audio/mpeg'
+    return None
+
+def sniff_mimetype(fileobj):
+    """Returns the MIME type of a seekable file from its first few bytes.
+
+    Common audio and archive formats are recognized by their magic
+    numbers; anything else goes to libmagic, which sees no more than
+    SNIFF_BYTES.  Leaves the file at its start.
+    """
+    fileobj.seek(0)
+    header = fileobj.read(HEADER_BYTES)
+    mimetype = _match_header(header, fileobj)
+    if mimetype is None:
+        if len(header) == HEADER_BYTES:
+            header += fileobj.read(SNIFF_BYTES - HEADER_BYTES)
+        mimetype = magic.from_buffer(header, mime=True)
+    fileobj.seek(0)
+    return mimetype
+
+def file_size(fileobj):
+    """Returns the size of a seekable file without reading any of it.
+
+    Uses the size the file or its storage already knows, if any, and
+    otherwise seeks to the end and back.
+    """
+    size = getattr(fileobj, 'size', None)
+    if isinstance(size, (int, long)):
+        return size
+    position = fileobj.tell()
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(position)
+    return size
+
+class InspectableFile(object):
+    """
+    Wraps a seekable file-like object for Inspector.
+
+    The mutagen classes below close the file they're handed when they're
+    done with it, so this ignores close() and leaves that to the owner;
+    the same handle can then go straight to storage.  It also provides
+    a size found by seeking, and an optional name to guess types from.
+    """
+    def __init__(self, fileobj, name=None):
+        self._fileobj = fileobj
+        if name is not None:
+            self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._fileobj, attr)
+
+    @property
+    def size(self):
+        return file_size(self._fileobj)
+
+    def close(self):
+        pass
+
 # Subclass various mutagen stuff to use file-like objects
 # instead of filenames, since it doesn't really know what
 # to do with our filenames...
 
 class ID3File(ID3):
     def load(self, fp, known_frames=None, translate=True):
-        self.filename = fp.name
+        self.filename = getattr(fp, 'name', None)
         self.__known_frames = known_frames
         self.__fileobj = fp
-        try:
-            self.__filesize = fp.size
-        except AttributeError:
-            self.__filesize = len(fp.read())
-            fp.seek(0)
+        self.__filesize = file_size(fp)
 
         # grumble grumble
         self.__load_header = self._ID3__load_header
@@ -61,10 +160,9 @@ class ID3File(ID3):
             except EOFError:
                 self.size = 0
                 raise ID3NoHeaderError("%s: too small (%d bytes)" %(
-                    filename, self.__filesize))
+                    self.filename, self.__filesize))
             except (ID3NoHeaderError, ID3UnsupportedVersionError), err:
                 self.size = 0
-                import sys
                 stack = sys.exc_info()[2]
                 try: self.__fileobj.seek(-128, 2)
                 except EnvironmentError: raise err, None, stack
@@ -95,7 +193,7 @@ class ID3File(ID3):
 
 class MP4File(MP4):
     def load(self, fp):
-        self.filename = fp.name
+        self.filename = getattr(fp, 'name', None)
         fileobj = fp
         try:
             atoms = Atoms(fileobj)
@@ -121,7 +219,7 @@ class FLACFile(FLAC):
         self.tags = None
         self.cuesheet = None
         self.seektable = None
-        self.filename = fp.name
+        self.filename = getattr(fp, 'name', None)
         fileobj = fp
         try:
             self.__check_header(fileobj)
@@ -140,7 +238,7 @@ class FLACFile(FLAC):
 
 class OggVorbisFile(OggVorbis):
     def load(self, fp):
-        self.filename = fp.name
+        self.filename = getattr(fp, 'name', None)
         fileobj = fp
         try:
             try:
@@ -167,12 +265,35 @@ class OggVorbisFile(OggVorbis):
     def delete(self, filename=None):
         raise NotImplementedError
 
+class OggOpusFile(OggOpus):
+    def load(self, fp):
+        self.filename = getattr(fp, 'name', None)
+        fileobj = fp
+        try:
+            try:
+                self.info = self._Info(fileobj)
+                self.tags = self._Tags(fileobj, self.info)
+                self.info._post_tags(fileobj)
+            except OggError, e:
+                raise self._Error, e, sys.exc_info()[2]
+            except EOFError:
+                raise self._Error, "no appropriate stream found"
+        finally:
+            fileobj.close()
+
+    def save(self, filename=None):
+        raise NotImplementedError
+    def delete(self, filename=None):
+        raise NotImplementedError
+
 class Inspector(object):
     """
     Given a file-like object, this class provides attributes for accessing
     various metadata stored in media objects.
     """
     def __init__(self, fileobj, mimetype=None):
+        if not isinstance(fileobj, InspectableFile):
+            fileobj = InspectableFile(fileobj)
         self._fileobj = fileobj
         self.mimetype = mimetype
         if not self.mimetype:
@@ -184,7 +305,7 @@ class Inspector(object):
         elif self.mimetype == 'audio/x-flac' or self.mimetype == 'audio/flac':
             self._inspect_flac()
         elif self.mimetype == 'audio/ogg':
-            self._inspect_oggvorbis()
+            self._inspect_ogg()
 
     def _determine_type(self):
         "Determines the type of a file, if possible."
@@ -193,22 +314,22 @@ class Inspector(object):
         if hasattr(self._fileobj, 'name'):
             self.mimetype = mt.guess_type(self._fileobj.name)[0]
         if not self.mimetype:
-            self.mimetype = magic.from_buffer(self._fileobj.read(), mime=True)
+            self.mimetype = sniff_mimetype(self._fileobj)
 
     def _inspect_mp4(self):
         "Cracks open an MP4 file and determines what is inside."
         self._fileobj.seek(0)
         mp4obj = MP4File(self._fileobj)
 
-        self.album = mp4obj.get('\xa9alb', None)[0]
-        self.artist = mp4obj.get('\xa9ART', None)[0]
+        self.album = mp4obj.get('\xa9alb', [None])[0]
+        self.artist = mp4obj.get('\xa9ART', [None])[0]
         self.bitrate = mp4obj.info.bitrate
         self.disc = mp4obj.get('disk', [[None]])[0][0]
-        self.genre = mp4obj.get('\xa9gen', None)[0]
+        self.genre = mp4obj.get('\xa9gen', [None])[0]
         self.length = mp4obj.info.length
         self.lossy = True
         self.is_compilation = mp4obj.get('cpil', False)
-        self.name = mp4obj.get('\xa9nam', None)[0]
+        self.name = mp4obj.get('\xa9nam', [None])[0]
         self.track = mp4obj.get('trkn', [[None]])[0][0]
         self.year = int(mp4obj.get('\xa9day')[0].split('-',1)[0]) if '\xa9day' in mp4obj else None
 
@@ -228,9 +349,10 @@ class Inspector(object):
     def _inspect_mp3(self):
         "Cracks open the mp3 file and determines what is inside."
         self._fileobj.seek(0)
-        infoobj = MPEGInfo(self._fileobj)
-        self._fileobj.seek(0)
         id3obj = ID3File(self._fileobj)
+        # Start looking for MPEG frames right after the tag we just read
+        self._fileobj.seek(0)
+        infoobj = MPEGInfo(self._fileobj, offset=id3obj.size or None)
 
         self.album = id3obj.get('TALB').text[0] if 'TALB' in id3obj else None
         self.artist = id3obj.get('TPE1').text[0] if 'TPE1' in id3obj else None
@@ -276,6 +398,37 @@ class Inspector(object):
 
         self.artwork = []   # TODO
 
+    def _inspect_ogg(self):
+        "Ogg files hold Vorbis or Opus; the first page says which."
+        self._fileobj.seek(0)
+        packets = OggPage(self._fileobj).packets
+        if packets and packets[0].startswith('OpusHead'):
+            self._inspect_opus()
+        else:
+            self._inspect_oggvorbis()
+
+    def _inspect_opus(self):
+        "Cracks open an Ogg Opus file and determines what is inside."
+        self._fileobj.seek(0)
+        oggobj = OggOpusFile(self._fileobj)
+
+        self.album          = oggobj.get('album', [None])[0]
+        self.artist         = oggobj.get('artist', [None])[0]
+        # Opus headers carry no bit rate; average it over the file
+        self.bitrate        = int(self._fileobj.size * 8 / oggobj.info.length) if oggobj.info.length else None
+        self.disc           = oggobj.get('discnumber', [None])[0]
+        self.genre          = oggobj.get('genre', [None])[0]
+        self.is_vbr         = True
+        self.length         = oggobj.info.length
+        self.lossy          = True
+        self.is_compilation = False  # TODO
+        self.name           = oggobj.get('title', [None])[0]
+        self.samplerate     = 48000  # Opus always decodes at 48 kHz
+        self.track          = oggobj.get('tracknumber', [None])[0]
+        self.year           = int(oggobj['date'][0].split('-')[0]) if 'date' in oggobj else None
+
+        self.artwork = []   # TODO
+
     def _inspect_oggvorbis(self):
         "Cracks open a FLAC file and determines what is inside."
         self._fileobj.seek(0)
@@ -0,0 +1,114 @@
+"""
+Seekable, read-only access to remote files through HTTP Range requests.
+
+Tags sit at the start of most media files (and ID3v1 in the last 128
+bytes), so inspecting a file in S3 needs only a few small pieces of it.
+A RangeFile fetches the blocks that reads touch, a run of adjacent
+blocks at a time, and keeps the most recent ones around.
+"""
+from mediastream.utilities import instrumentation
+from mediastream.utilities.lru import LRUCache
+
+import errno
+
+BLOCK_SIZE = 64*1024
+MAX_BLOCKS = 32
+
+class RangeFile(object):
+    """
+    Wraps a boto Key, or anything else with name and size attributes
+    and a get_contents_as_string(headers=...) method that honors Range.
+
+    requests and bytes_fetched count what it has downloaded so far.
+    """
+    def __init__(self, key, name=None, block_size=BLOCK_SIZE, max_blocks=MAX_BLOCKS):
+        self.key = key
+        self.name = name or key.name
+        self.size = key.size
+        self.block_size = block_size
+        self.closed = False
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._blocks = LRUCache(max_blocks)
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError(errno.EINVAL, 'Invalid argument')
+        self._position = offset
+
+    def read(self, size=-1):
+        start = self._position
+        end = self.size if size is None or size < 0 else min(self.size, start + size)
+        if end <= start:
+            return ''
+        first, last = start // self.block_size, (end - 1) // self.block_size
+        data = ''.join(self._get_blocks(first, last))
+        offset = first * self.block_size
+        self._position = end
+        return data[start - offset:end - offset]
+
+    def close(self):
+        self.closed = True
+        self._blocks.clear()
+
+    def _get_blocks(self, first, last):
+        "Returns blocks first through last, fetching missing runs in one request each."
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = self._blocks.get(index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+
+        runs = []
+        for index in missing:
+            if runs and runs[-1][-1] == index - 1:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        for run in runs:
+            data = self._fetch(run[0] * self.block_size,
+                               min(self.size, (run[-1] + 1) * self.block_size) - 1)
+            for index in run:
+                offset = (index - run[0]) * self.block_size
+                blocks[index] = data[offset:offset + self.block_size]
+                self._blocks.set(index, blocks[index])
+
+        return [blocks[index] for index in range(first, last + 1)]
+
+    def _fetch(self, start, end):
+        "Downloads bytes start through end, inclusive."
+        with instrumentation.timed_http():
+            data = self.key.get_contents_as_string(
+                headers={'Range': 'bytes=%i-%i' % (start, end)})
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        return data
+
+def open_ranged(fieldfile, **kwargs):
+    """Opens a stored file for reading without downloading all of it.
+
+    Files in S3 come back as a RangeFile; anything else, including
+    gzipped S3 objects, is opened by its storage as usual.
+    """
+    f = fieldfile.storage.open(fieldfile.name, 'rb')
+    key = getattr(f, 'key', None)
+    if key is None or getattr(key, 'content_encoding', None) == 'gzip':
+        return f
+    return RangeFile(key, name=fieldfile.name, **kwargs)
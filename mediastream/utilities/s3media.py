@@ -0,0 +1,87 @@
+"""
+S3 storage for media files that remembers the signed URLs it makes.
+
+Signing a query-string-auth URL builds a boto request and an HMAC every
+time, and album playlists and the player ask for one per track on every
+render.  Signed URLs are kept in the Django cache, and in a small LRU in
+each process, until AWS_QUERYSTRING_CACHE_MARGIN seconds before they
+expire, so every URL handed out stays valid for at least that long.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+from storages.backends.s3boto import S3BotoStorage
+
+from mediastream.utilities.lru import LRUCache
+
+import hashlib
+import time
+
+class S3MediaStorage(S3BotoStorage):
+    "Subclasses S3BotoStorage to cache the URLs it signs."
+    querystring_cache_margin = getattr(settings, 'AWS_QUERYSTRING_CACHE_MARGIN', 3600)
+    local_url_cache_size = getattr(settings, 'AWS_QUERYSTRING_CACHE_LOCAL', 1024)
+
+    def __init__(self, acl=None, bucket=None, **settings):
+        super(S3MediaStorage, self).__init__(acl, bucket, **settings)
+        self._urls = LRUCache(self.local_url_cache_size)
+
+    def get_url_ttl(self):
+        "Returns how long a signed URL may be handed out for; 0 turns caching off."
+        return max(self.querystring_expire - self.querystring_cache_margin, 0)
+
+    def url(self, name):
+        return self.urls([name])[name]
+
+    def urls(self, names):
+        """Returns a dict of URLs for names, signing only those not cached.
+
+        Cached URLs are looked up with one cache.get_many(), and the new
+        ones stored with one cache.set_many().
+        """
+        ttl = self.get_url_ttl()
+        if not ttl:
+            return dict((name, super(S3MediaStorage, self).url(name)) for name in names)
+
+        now = time.time()
+        found = {}
+        missing = {}
+        for name in names:
+            hit = self._urls.get(name)
+            if hit is not None and hit[1] > now:
+                found[name] = hit[0]
+            else:
+                missing[self._get_url_cache_key(name)] = name
+        if not missing:
+            return found
+
+        cached = cache.get_many(missing.keys())
+        signed = {}
+        for key, name in missing.items():
+            if key in cached:
+                url, expires = cached[key]
+            else:
+                url, expires = super(S3MediaStorage, self).url(name), now + ttl
+                signed[key] = (url, expires)
+            self._urls.set(name, (url, expires))
+            found[name] = url
+        if signed:
+            cache.set_many(signed, ttl)
+        return found
+
+    def _get_url_cache_key(self, name):
+        return 's3url:' + hashlib.sha1(force_bytes(u'{0}/{1}'.format(
+            self.bucket_name, name))).hexdigest()
+
+def prefetch_urls(fieldfiles):
+    """Looks up the URLs of many stored files at once.
+
+    Afterwards their .url comes from the per-process cache.  Files in
+    storages other than S3MediaStorage are left alone.
+    """
+    names = {}
+    for fieldfile in fieldfiles:
+        if fieldfile and hasattr(fieldfile.storage, 'urls'):
+            names.setdefault(fieldfile.storage, set()).add(fieldfile.name)
+    for storage, storage_names in names.items():
+        storage.urls(storage_names)
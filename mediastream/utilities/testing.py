@@ -0,0 +1,36 @@
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import connection
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.functional import empty
+
+import os
+import tempfile
+
+# Renders templates and file URLs without S3 or local_settings.
+local_site = override_settings(
+    TEMPLATE_DIRS=(os.path.join(os.path.dirname(__file__), '..', 'templates'),),
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT=tempfile.gettempdir(),
+    MEDIA_URL='/media/',
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    STATIC_URL='/static/',
+)
+
+@receiver(setting_changed)
+def _staticfiles_storage_changed(setting, **kwargs):
+    # Django resets default_storage on its own, but not this one.
+    if setting == 'STATICFILES_STORAGE':
+        staticfiles_storage._wrapped = empty
+
+class QueryBudgetMixin(object):
+    "TestCase mixin for asserting that a call stays within a query budget."
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = func(*args, **kwargs)
+        if len(queries) > budget:
+            self.fail(u"%i queries, over the budget of %i:\n%s" % (
+                len(queries), budget,
+                u'\n'.join(q['sql'] for q in queries.captured_queries)))
+        return result